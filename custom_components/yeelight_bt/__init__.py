@@ -1,55 +1,328 @@
 """Control Yeelight bluetooth lamp."""
+from __future__ import annotations
+
+import asyncio
 import logging
+import time
+from functools import partial
+from typing import Callable
 
+from bleak.backends.device import BLEDevice
 from homeassistant.components.bluetooth import (
+    BluetoothCallbackMatcher,
+    BluetoothChange,
+    BluetoothScanningMode,
+    BluetoothServiceInfoBleak,
     async_ble_device_from_address,
+    async_register_callback,
     async_scanner_count,
+    async_track_unavailable,
 )
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import CONF_MAC
-from homeassistant.core import HomeAssistant
-from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.core import HomeAssistant, callback
 
-from .const import DOMAIN
+from .const import (
+    CONF_CONNECTION_POLICY,
+    CONF_IDLE_TIMEOUT,
+    DATA_COORDINATOR,
+    DATA_STORE,
+    DOMAIN,
+    MAX_PARALLEL_REFRESH,
+    MAX_REFRESH_INTERVAL,
+    MIN_REFRESH_INTERVAL,
+    PLATFORMS,
+    REFRESH_BACKOFF,
+    REFRESH_INTERVAL,
+)
+from .services import async_setup_services, async_unload_services
+from .store import YeelightBTStore
+from .yeelightbt import (
+    DEFAULT_IDLE_TIMEOUT,
+    ConnectionPolicy,
+    Lamp,
+    LampState,
+    Priority,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
-    """Set up yeelight_bt from a config entry."""
+    """Set up yeelight_bt from a config entry.
+    The entry is set up straight away, without connecting: the lamp connects in
+    the background once HA bluetooth has seen it advertise.
+    """
     _LOGGER.debug(f"integration async setup entry: {entry.as_dict()}")
+    start = time.perf_counter()
     hass.data.setdefault(DOMAIN, {})
-
-    # Find ble device here so that we can raise device not found on startup
-    address = entry.data.get(CONF_MAC)
+    address = entry.data.get(CONF_MAC).upper()
 
     # try to get ble_device using HA scanner first
-    ble_device = async_ble_device_from_address(hass, address.upper(), connectable=True)
+    ble_device = async_ble_device_from_address(hass, address, connectable=True)
     _LOGGER.debug(f"BLE device through HA bt: {ble_device}")
     if ble_device is None:
         # Check if any HA scanner on:
         count_scanners = async_scanner_count(hass, connectable=True)
         _LOGGER.debug(f"Count of BLE scanners in HA bt: {count_scanners}")
         if count_scanners < 1:
-            raise ConfigEntryNotReady(
+            _LOGGER.warning(
                 "No bluetooth scanner detected. \
                 Enable the bluetooth integration or ensure an esphome device \
                 is running as a bluetooth proxy"
             )
-        raise ConfigEntryNotReady(f"Could not find Yeelight with address {address}")
+        # stands for the lamp until it advertises:
+        ble_device = BLEDevice(address, None, None)
 
-    hass.data[DOMAIN][entry.entry_id] = ble_device
-    await hass.config_entries.async_forward_entry_setups(entry, ["light"])
+    lamp = Lamp(ble_device)
+    # out of range until it advertises, HA bluetooth tells when it does:
+    lamp.presence.start_tracking()
+    apply_options(lamp, entry)
+    if DATA_STORE not in hass.data[DOMAIN]:
+        store = YeelightBTStore(hass)
+        await store.async_load()
+        hass.data[DOMAIN].setdefault(DATA_STORE, store)
+    # restore what the lamp told before the last restart:
+    hass.data[DOMAIN][DATA_STORE].add_lamp(lamp)
+    hass.data[DOMAIN][entry.entry_id] = lamp
+    if DATA_COORDINATOR not in hass.data[DOMAIN]:
+        hass.data[DOMAIN][DATA_COORDINATOR] = YeelightBTCoordinator(hass)
+    coordinator = hass.data[DOMAIN][DATA_COORDINATOR]
+    coordinator.add_lamp(lamp)
+    async_setup_services(hass)
+
+    @callback
+    def _async_advertised(
+        service_info: BluetoothServiceInfoBleak, change: BluetoothChange
+    ) -> None:
+        if lamp.advertised(service_info.device, service_info.rssi):
+            coordinator.device_seen(lamp)
+
+    @callback
+    def _async_unavailable(service_info: BluetoothServiceInfoBleak) -> None:
+        lamp.out_of_range()
+
+    # also called straight away if the lamp was already seen:
+    entry.async_on_unload(
+        async_register_callback(
+            hass,
+            _async_advertised,
+            BluetoothCallbackMatcher(address=address, connectable=True),
+            BluetoothScanningMode.PASSIVE,
+        )
+    )
+    entry.async_on_unload(
+        async_track_unavailable(hass, _async_unavailable, address, connectable=True)
+    )
+    entry.async_on_unload(entry.add_update_listener(async_update_options))
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    _LOGGER.debug(
+        f"Set up {address} in {(time.perf_counter() - start) * 1000:.1f}ms "
+        f"({len(coordinator.lamps)} lamps)"
+    )
     return True
 
 
+def apply_options(lamp: Lamp, entry: ConfigEntry) -> None:
+    """Apply the connection policy chosen in the options of the entry"""
+    lamp.set_connection_policy(
+        ConnectionPolicy(
+            entry.options.get(CONF_CONNECTION_POLICY, ConnectionPolicy.ALWAYS.value)
+        ),
+        entry.options.get(CONF_IDLE_TIMEOUT, DEFAULT_IDLE_TIMEOUT),
+    )
+
+
+async def async_update_options(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Handle options update."""
+    apply_options(hass.data[DOMAIN][entry.entry_id], entry)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     _LOGGER.debug("async unload entry")
-    unload_ok = await hass.config_entries.async_forward_entry_unload(entry, "light")
+    unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
 
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        lamp = hass.data[DOMAIN].pop(entry.entry_id)
+        coordinator = hass.data[DOMAIN][DATA_COORDINATOR]
+        coordinator.remove_lamp(lamp)
+        if not coordinator.lamps:
+            coordinator.stop()
+            hass.data[DOMAIN].pop(DATA_COORDINATOR)
+            async_unload_services(hass)
+        hass.data[DOMAIN][DATA_STORE].remove_lamp(lamp)
         if not hass.config_entries.async_entries(DOMAIN):
             hass.data.pop(DOMAIN)
     return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Forget the saved data of a removed lamp."""
+    store = hass.data.get(DOMAIN, {}).get(DATA_STORE)
+    if store is None:
+        store = YeelightBTStore(hass)
+        await store.async_load()
+    await store.async_forget(entry.data[CONF_MAC].upper())
+
+
+class YeelightBTCoordinator:
+    """Refresh the state of all the yeelight_bt lamps.
+    Each lamp has its own refresh interval: short right after user activity, a
+    disconnection or a change of state, then backing off towards a long ceiling
+    while the lamp state stays the same. State notifications count as fresh data.
+    The refreshes are spread over time and only a few run at the same time.
+    A lamp is only refreshed while it is reachable (in range, and not failing
+    to connect), and straight away when it comes in range, which connects it.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        interval: float = REFRESH_INTERVAL,
+        max_parallel: int = MAX_PARALLEL_REFRESH,
+    ) -> None:
+        self._hass = hass
+        self._base_interval = interval
+        self._semaphore = asyncio.Semaphore(max_parallel)
+        self._lamps: dict[str, Lamp] = {}
+        # current refresh interval of each lamp:
+        self._intervals: dict[str, float] = {}
+        # last state seen for each lamp, to detect it is stable:
+        self._states: dict[str, LampState | None] = {}
+        self._callbacks: dict[str, Callable[[], None]] = {}
+        # loop time at which each lamp is due for a refresh:
+        self._due: dict[str, float] = {}
+        self._changed = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+        self._refreshes: set[asyncio.Task[None]] = set()
+
+    @property
+    def lamps(self) -> list[Lamp]:
+        return list(self._lamps.values())
+
+    def interval(self, lamp: Lamp) -> float:
+        """The effective refresh interval of a lamp, in seconds"""
+        return self._intervals.get(lamp.mac, self._base_interval)
+
+    def add_lamp(self, lamp: Lamp) -> None:
+        self._lamps[lamp.mac] = lamp
+        self._set_interval(lamp, self._base_interval)
+        self._states[lamp.mac] = None
+        self._callbacks[lamp.mac] = partial(self._lamp_updated, lamp)
+        lamp.add_callback_on_state_changed(self._callbacks[lamp.mac])
+        self._spread()
+        if self._task is None:
+            self._task = self._hass.async_create_background_task(
+                self._run(), f"{DOMAIN} refresh"
+            )
+
+    def remove_lamp(self, lamp: Lamp) -> None:
+        self._lamps.pop(lamp.mac, None)
+        self._intervals.pop(lamp.mac, None)
+        self._states.pop(lamp.mac, None)
+        self._due.pop(lamp.mac, None)
+        lamp.remove_callback_on_state_changed(self._callbacks.pop(lamp.mac))
+        self._changed.set()
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in self._refreshes:
+            task.cancel()
+
+    def device_seen(self, lamp: Lamp) -> None:
+        """The lamp came in range: refresh it (and so connect it) now"""
+        if lamp.mac not in self._lamps:
+            return
+        self._due[lamp.mac] = self._hass.loop.time()
+        self._changed.set()
+
+    def notify_activity(self, lamp: Lamp) -> None:
+        """The user just sent commands to the lamp: check its state again soon"""
+        self._reset(lamp)
+
+    def _lamp_updated(self, lamp: Lamp) -> None:
+        """State notification or disconnection of a lamp"""
+        if not lamp.available:
+            self._states[lamp.mac] = None
+            self._reset(lamp)
+            return
+        state = lamp.state
+        if state != self._states[lamp.mac]:
+            self._states[lamp.mac] = state
+            self._reset(lamp)
+            return
+        # stable state, back off:
+        self._set_interval(
+            lamp, min(self._intervals[lamp.mac] * REFRESH_BACKOFF, MAX_REFRESH_INTERVAL)
+        )
+
+    def _reset(self, lamp: Lamp) -> None:
+        if lamp.mac not in self._lamps:
+            return
+        self._set_interval(lamp, MIN_REFRESH_INTERVAL)
+        due = self._hass.loop.time() + MIN_REFRESH_INTERVAL
+        if due < self._due[lamp.mac]:
+            self._due[lamp.mac] = due
+            self._changed.set()
+
+    def _set_interval(self, lamp: Lamp, interval: float) -> None:
+        self._intervals[lamp.mac] = interval
+        # the keepalive of an always connected lamp follows, so that it only
+        # reads the state when no refresh or notification came for as long:
+        lamp.set_keepalive_interval(interval)
+
+    def _spread(self) -> None:
+        """Spread the next refresh of each lamp evenly over its interval"""
+        now = self._hass.loop.time()
+        for index, mac in enumerate(self._lamps):
+            step = self._intervals[mac] / len(self._lamps)
+            self._due[mac] = now + (index + 1) * step
+        self._changed.set()
+
+    async def _run(self) -> None:
+        while True:
+            self._changed.clear()
+            if not self._due:
+                await self._changed.wait()
+                continue
+            mac = min(self._due, key=self._due.__getitem__)
+            delay = self._due[mac] - self._hass.loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), delay)
+                    continue  # the schedule changed
+                except asyncio.TimeoutError:
+                    pass
+            lamp = self._lamps[mac]
+            interval = self._intervals[mac]
+            if not lamp.reachable:
+                # out of range or failing to connect, do not try for now:
+                self._due[mac] += interval
+                continue
+            if lamp.state_age < interval:
+                # the state was notified recently, it is fresh until then:
+                self._due[mac] += interval - lamp.state_age
+                continue
+            self._due[mac] += interval
+            task = self._hass.async_create_background_task(
+                self._refresh(lamp), f"{DOMAIN} refresh {mac}"
+            )
+            self._refreshes.add(task)
+            task.add_done_callback(self._refreshes.discard)
+
+    async def _refresh(self, lamp: Lamp) -> None:
+        # right after activity, the read checks the lamp followed the commands:
+        if self._intervals.get(lamp.mac) == MIN_REFRESH_INTERVAL:
+            priority = Priority.RECONCILE
+        else:
+            priority = Priority.POLL
+        async with self._semaphore:
+            try:
+                _LOGGER.debug(f"Requesting an update of the lamp {lamp.mac} status")
+                await lamp.get_state(priority)
+            except Exception as ex:
+                _LOGGER.error(f"Fail requesting the light status. Got exception: {ex}")
+                _LOGGER.debug("Yeelight_BT trace:", exc_info=True)
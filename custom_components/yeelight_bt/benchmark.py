@@ -0,0 +1,275 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Benchmark of the command path against simulated lamps.
+Reports cold connect time, per command latency (p50/p99), commands per second,
+notification decode rate, and CPU time and memory per lamp, for several lamp
+counts. It also checks that concurrent callers share a single connection to a
+lamp (exiting with an error otherwise). The output is JSON, so that runs can be
+compared to a baseline:
+
+    python -m custom_components.yeelight_bt.benchmark --output run.json
+    python -m custom_components.yeelight_bt.benchmark --baseline run.json
+"""
+from __future__ import annotations
+
+# Standard imports
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import struct
+import sys
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable
+
+from .codec import COMMAND_STX, RES_GETSTATE
+from .connection import ConnectionManager
+from .light import YeelightBT
+from .metrics import percentiles
+from .simulator import Simulator
+from .yeelightbt import Lamp, Priority
+
+DEFAULT_LAMP_COUNTS = [1, 10, 100, 500]
+DEFAULT_COMMANDS = 20
+DEFAULT_DECODES = 100_000
+DEFAULT_CONCURRENT_CALLERS = 200
+
+# Metrics compared against a baseline, and whether higher is better:
+_KEY_METRICS = {
+    "connect.p50": False,
+    "connect.p99": False,
+    "commands_per_second": True,
+    "cpu_ms_per_lamp": False,
+    "memory_kib_per_lamp": False,
+}
+
+
+class _Coordinator:
+    """Stands for the integration coordinator behind the light entities"""
+
+    def notify_activity(self, lamp: Lamp) -> None:
+        pass
+
+    def interval(self, lamp: Lamp) -> float:
+        return 0.0
+
+
+def _create_lamps(
+    simulator: Simulator, count: int, latency: float
+) -> tuple[list[Lamp], ConnectionManager]:
+    # a single virtual adapter holding all lamps at once:
+    manager = ConnectionManager(max_connections=count)
+    lamps = []
+    for _ in range(count):
+        device = simulator.add_lamp(latency=latency, connect_latency=latency)
+        lamps.append(
+            Lamp(
+                device.ble_device,
+                connection_manager=manager,
+                connector=simulator.establish_connection,
+            )
+        )
+    return lamps, manager
+
+
+async def _timed(durations: list[float], call: Awaitable[Any]) -> None:
+    start = time.perf_counter()
+    await call
+    durations.append(time.perf_counter() - start)
+
+
+async def _connect_all(lamps: list[Lamp]) -> list[float]:
+    durations: list[float] = []
+    await asyncio.gather(*(_timed(durations, lamp.connect()) for lamp in lamps))
+    return durations
+
+
+async def _run_commands(
+    lamp: Lamp, commands: int, latencies: dict[str, list[float]]
+) -> None:
+    """Send a mix of commands to a lamp, one after the other"""
+    entity = YeelightBT("benchmark", lamp, _Coordinator())  # type: ignore[arg-type]
+    # the entity has no hass to write its state to:
+    lamp.remove_callback_on_state_changed(entity._status_cb)
+    mix: list[tuple[str, Callable[[int], Awaitable[Any]]]] = [
+        ("turn_on", lambda i: lamp.turn_on()),
+        ("set_brightness", lambda i: lamp.set_brightness(10 + i % 90)),
+        ("set_color", lambda i: lamp.set_color(i % 256, 128, 255 - i % 256)),
+        ("set_temperature", lambda i: lamp.set_temperature(1700 + 100 * (i % 48))),
+        ("get_state", lambda i: lamp.get_state()),
+        ("entity_turn_on", lambda i: entity.async_turn_on(brightness=1 + i % 255)),
+    ]
+    for i in range(commands):
+        name, command = mix[i % len(mix)]
+        await _timed(latencies.setdefault(name, []), command(i))
+
+
+async def bench_lamps(count: int, commands: int, latency: float) -> dict[str, Any]:
+    """Connect then command a number of simulated lamps concurrently"""
+    # memory held per connected lamp, measured on its own as tracing is slow:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    lamps, _ = _create_lamps(Simulator(seed=count), count, latency)
+    await _connect_all(lamps)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    for lamp in lamps:
+        await lamp.close()
+
+    lamps, _ = _create_lamps(Simulator(seed=count), count, latency)
+    cpu_start = time.process_time()
+    connect_start = time.perf_counter()
+    connects = await _connect_all(lamps)
+    connect_wall = time.perf_counter() - connect_start
+    latencies: dict[str, list[float]] = {}
+    commands_start = time.perf_counter()
+    await asyncio.gather(*(_run_commands(lamp, commands, latencies) for lamp in lamps))
+    commands_wall = time.perf_counter() - commands_start
+    cpu = time.process_time() - cpu_start
+    for lamp in lamps:
+        await lamp.close()
+
+    sent = sum(len(values) for values in latencies.values())
+    return {
+        "lamps": count,
+        "connect": {**percentiles(connects), "wall_s": round(connect_wall, 3)},
+        "commands": {name: percentiles(values) for name, values in latencies.items()},
+        "commands_per_second": round(sent / commands_wall, 1),
+        "cpu_ms_per_lamp": round(cpu * 1000 / count, 3),
+        "memory_kib_per_lamp": round(memory / 1024 / count, 2),
+    }
+
+
+def bench_decode(count: int) -> dict[str, Any]:
+    """Rate at which a lamp processes state notifications"""
+    simulator = Simulator()
+    lamp = Lamp(
+        simulator.add_lamp().ble_device, connector=simulator.establish_connection
+    )
+    frame = bytearray(
+        struct.pack(
+            ">BBBBBBBBBhx6x", COMMAND_STX, RES_GETSTATE, 1, 1, 10, 20, 30, 0, 50, 4000
+        )
+    )
+    handler = lamp.notification_handler
+    start = time.perf_counter()
+    for _ in range(count):
+        handler(0, frame)
+    elapsed = time.perf_counter() - start
+    return {
+        "notifications": count,
+        "per_second": round(count / elapsed),
+        "us_per_notification": round(elapsed / count * 1e6, 3),
+    }
+
+
+async def bench_single_flight(callers: int, latency: float) -> dict[str, Any]:
+    """Fire concurrent connections, commands and polls at a disconnected lamp,
+    which must all share the same connection
+    """
+    simulator = Simulator(seed=callers)
+    device = simulator.add_lamp(latency=latency, connect_latency=max(latency, 0.01))
+    lamp = Lamp(device.ble_device, connector=simulator.establish_connection)
+    mix: list[Callable[[int], Awaitable[Any]]] = [
+        lambda i: lamp.connect(),
+        lambda i: lamp.set_brightness(1 + i % 100),
+        lambda i: lamp.get_state(Priority.POLL),
+        lambda i: lamp.turn_on(),
+    ]
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(mix[i % len(mix)](i) for i in range(callers)), return_exceptions=True
+    )
+    elapsed = time.perf_counter() - start
+    await lamp.close()
+    return {
+        "callers": callers,
+        "connections": device.stats["connects"],
+        "errors": sum(isinstance(result, BaseException) for result in results),
+        "elapsed_ms": round(elapsed * 1000, 3),
+    }
+
+
+async def run(lamp_counts: list[int], commands: int, latency: float) -> dict[str, Any]:
+    results: dict[str, Any] = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commands_per_lamp": commands,
+            "latency_s": latency,
+        },
+        "decode": bench_decode(DEFAULT_DECODES),
+        "single_flight": await bench_single_flight(DEFAULT_CONCURRENT_CALLERS, latency),
+        "runs": [],
+    }
+    for count in lamp_counts:
+        print(f"Benchmarking {count} lamps...", file=sys.stderr)
+        results["runs"].append(await bench_lamps(count, commands, latency))
+    return results
+
+
+def _metric(run: dict[str, Any], path: str) -> float:
+    value: Any = run
+    for key in path.split("."):
+        value = value[key]
+    return float(value)
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any]) -> list[str]:
+    """Describe the change of the key metrics against a baseline run"""
+    lines = []
+    for key in ("commands_per_lamp", "latency_s"):
+        if results["meta"].get(key) != baseline.get("meta", {}).get(key):
+            lines.append(f"Warning: the baseline was run with a different {key}")
+    previous = {run["lamps"]: run for run in baseline.get("runs", [])}
+    for run in results["runs"]:
+        base = previous.get(run["lamps"])
+        if base is None:
+            continue
+        for path, higher_is_better in _KEY_METRICS.items():
+            new, old = _metric(run, path), _metric(base, path)
+            change = (new - old) / old * 100 if old else 0.0
+            better = (change > 0) == higher_is_better
+            verdict = "better" if better else "worse"
+            lines.append(
+                f"{run['lamps']:>4} lamps {path:<22} {old:>12} -> {new:>12} "
+                f"({change:+.1f}%, {verdict if abs(change) >= 1 else 'same'})"
+            )
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--lamps", type=int, nargs="+", default=DEFAULT_LAMP_COUNTS)
+    parser.add_argument("--commands", type=int, default=DEFAULT_COMMANDS)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="simulated link latency (s)"
+    )
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(args.lamps, args.commands, args.latency))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print("\n".join(compare(results, baseline)), file=sys.stderr)
+    single_flight = results["single_flight"]
+    if single_flight["connections"] != 1 or single_flight["errors"]:
+        sys.exit(f"Concurrent callers did not share one connection: {single_flight}")
+
+
+if __name__ == "__main__":
+    main()
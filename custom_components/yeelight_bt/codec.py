@@ -0,0 +1,245 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Wire protocol of the lamps: every frame is 18 bytes, starting with COMMAND_STX
+and the command (or response) type.
+Frames without a value are built once, frames with values are packed by
+precompiled structs, either to new bytes or into a caller owned buffer.
+Notifications are decoded in place by the decoder of their response type.
+"""
+from __future__ import annotations
+
+# Standard imports
+import logging
+import struct
+from typing import Any, Callable, NamedTuple
+
+FRAME_SIZE = 18
+
+COMMAND_STX = 0x43
+CMD_PAIR = 0x67
+CMD_PAIR_ON = 0x02
+RES_PAIR = 0x63
+CMD_POWER = 0x40
+CMD_POWER_ON = 0x01
+CMD_POWER_OFF = 0x02
+CMD_COLOR = 0x41
+CMD_BRIGHTNESS = 0x42
+CMD_TEMP = 0x43
+CMD_RGB = 0x41
+CMD_GETSTATE = 0x44
+CMD_GETSTATE_SEC = 0x02
+RES_GETSTATE = 0x45
+CMD_GETNAME = 0x52
+RES_GETNAME = 0x53
+CMD_GETVER = 0x5C
+RES_GETVER = 0x5D
+CMD_GETSERIAL = 0x5E
+RES_GETSERIAL = 0x5F
+RES_GETTIME = 0x62
+
+_CMD = struct.Struct("BB16x")
+_CMD_BYTE = struct.Struct("BBB15x")
+_CMD_TEMP = struct.Struct(">BBhB13x")
+_CMD_COLOR = struct.Struct("BBBBBBB11x")
+# bound once, saving the attribute lookups on each frame:
+_pack_byte = _CMD_BYTE.pack
+_pack_temp = _CMD_TEMP.pack
+_pack_color = _CMD_COLOR.pack
+
+# Frames carrying no value:
+FRAME_PAIR = _CMD_BYTE.pack(COMMAND_STX, CMD_PAIR, CMD_PAIR_ON)
+FRAME_POWER_ON = _CMD_BYTE.pack(COMMAND_STX, CMD_POWER, CMD_POWER_ON)
+FRAME_POWER_OFF = _CMD_BYTE.pack(COMMAND_STX, CMD_POWER, CMD_POWER_OFF)
+FRAME_GETSTATE = _CMD_BYTE.pack(COMMAND_STX, CMD_GETSTATE, CMD_GETSTATE_SEC)
+FRAME_GETNAME = _CMD.pack(COMMAND_STX, CMD_GETNAME)
+FRAME_GETVER = _CMD.pack(COMMAND_STX, CMD_GETVER)
+FRAME_GETSERIAL = _CMD.pack(COMMAND_STX, CMD_GETSERIAL)
+
+
+def encode_brightness(brightness: int) -> bytes:
+    """Brightness [0-100] frame"""
+    return _pack_byte(COMMAND_STX, CMD_BRIGHTNESS, brightness)
+
+
+def encode_temperature(kelvin: int, brightness: int) -> bytes:
+    """Temperature [1700-6500 K] and brightness [0-100] frame"""
+    return _pack_temp(COMMAND_STX, CMD_TEMP, kelvin, brightness)
+
+
+def encode_color(red: int, green: int, blue: int, brightness: int) -> bytes:
+    """Color [0-255] and brightness [0-100] frame"""
+    return _pack_color(COMMAND_STX, CMD_RGB, red, green, blue, 0x01, brightness)
+
+
+# The *_into variants fill FRAME_SIZE bytes of a buffer at the given offset,
+# for callers building many frames at once (e.g. effects):
+def encode_brightness_into(buffer: bytearray, offset: int, brightness: int) -> None:
+    _CMD_BYTE.pack_into(buffer, offset, COMMAND_STX, CMD_BRIGHTNESS, brightness)
+
+
+def encode_temperature_into(
+    buffer: bytearray, offset: int, kelvin: int, brightness: int
+) -> None:
+    _CMD_TEMP.pack_into(buffer, offset, COMMAND_STX, CMD_TEMP, kelvin, brightness)
+
+
+def encode_color_into(
+    buffer: bytearray, offset: int, red: int, green: int, blue: int, brightness: int
+) -> None:
+    _CMD_COLOR.pack_into(
+        buffer, offset, COMMAND_STX, CMD_RGB, red, green, blue, 0x01, brightness
+    )
+
+
+# Results mirror the layout of their notification, so that they are built
+# straight from the unpacked fields:
+class StateResult(NamedTuple):
+    """State notification of a Bedside lamp"""
+
+    power: int
+    mode: int
+    red: int
+    green: int
+    blue: int
+    white: int
+    brightness: int
+    temperature: int
+
+
+class CandelaStateResult(NamedTuple):
+    """State notification of a Candela lamp (which also sends 2 unknown bytes)"""
+
+    power: int
+    brightness: int
+    mode: int
+
+
+class PairResult(NamedTuple):
+    """Pairing notification: 1 push the button, 2 paired, 3 not paired,
+    4 already paired, 6/7 pairing failed"""
+
+    status: int
+
+
+class VersionResult(NamedTuple):
+    """Version notification, major.minor.patch being the firmware version"""
+
+    head: int
+    major: int
+    minor: int
+    patch: int
+    tail: int
+
+
+class SerialResult(NamedTuple):
+    serial: int
+
+
+class NameResult(NamedTuple):
+    name: str
+
+
+class TimeResult(NamedTuple):
+    """Time notification, its layout is not known so it is kept raw"""
+
+    payload: bytes
+
+
+Buffer = bytes | bytearray | memoryview
+Decoder = Callable[[Buffer], Any]
+
+
+def _decoder(layout: str, result: Any) -> Decoder:
+    """Return a decoder unpacking the notification payload into a result"""
+    unpack_from = struct.Struct(layout).unpack_from
+    make = result._make
+    return lambda data: make(unpack_from(data, 2))
+
+
+def _decode_name(data: Buffer) -> NameResult:
+    # the name is sent as a null-padded string after the header
+    return NameResult(
+        bytes(memoryview(data)[2:]).rstrip(b"\x00").decode("utf-8", "replace")
+    )
+
+
+def _decode_time(data: Buffer) -> TimeResult:
+    return TimeResult(bytes(memoryview(data)[2:]))
+
+
+# Decoders of the notifications per response type:
+DECODERS: dict[int, Decoder] = {
+    RES_GETSTATE: _decoder(">BBBBBBBh", StateResult),
+    RES_PAIR: _decoder("B", PairResult),
+    # native alignment, as the lamp sends it:
+    RES_GETVER: _decoder("BHHHH", VersionResult),
+    RES_GETSERIAL: _decoder("B", SerialResult),
+    RES_GETNAME: _decode_name,
+    RES_GETTIME: _decode_time,
+}
+CANDELA_DECODERS: dict[int, Decoder] = {
+    **DECODERS,
+    RES_GETSTATE: _decoder("BBB", CandelaStateResult),
+}
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def decode_notification(
+    data: Buffer, decoders: dict[int, Decoder] = DECODERS
+) -> tuple[int, Any] | None:
+    """Return the response type and decoded result of a notification.
+    The result is None for unknown response types and malformed frames.
+    Returns None if the frame has no header at all.
+    """
+    if len(data) < 2:
+        _LOGGER.debug("Ignoring invalid notification 0x%s", bytes(data).hex())
+        return None
+    res_type = data[1]
+    decoder = decoders.get(res_type)
+    if decoder is None:
+        _LOGGER.debug("Unknown notification type 0x%02x", res_type)
+        return res_type, None
+    try:
+        return res_type, decoder(data)
+    except struct.error:
+        _LOGGER.warning("Malformed notification 0x%s", bytes(data).hex())
+        return res_type, None
+
+
+if __name__ == "__main__":
+    # micro-benchmark of the encode path against packing with a format string
+    import timeit
+
+    NUMBER = 1_000_000
+    buffer = bytearray(FRAME_SIZE)
+    state = bytearray(
+        struct.pack(
+            ">BBBBBBBBBhx6x", COMMAND_STX, RES_GETSTATE, 1, 1, 10, 20, 30, 0, 50, 4000
+        )
+    )
+    cases = {
+        "power on, struct.pack(format)": lambda: struct.pack(
+            "BBB15x", COMMAND_STX, CMD_POWER, CMD_POWER_ON
+        ),
+        "power on, constant frame": lambda: FRAME_POWER_ON,
+        "color, struct.pack(format)": lambda: struct.pack(
+            "BBBBBBB11x", COMMAND_STX, CMD_RGB, 10, 20, 30, 0x01, 50
+        ),
+        "color, encode_color": lambda: encode_color(10, 20, 30, 50),
+        "color, encode_color_into": lambda: encode_color_into(
+            buffer, 0, 10, 20, 30, 50
+        ),
+        "temperature, struct.pack(format)": lambda: struct.pack(
+            ">BBhB13x", COMMAND_STX, CMD_TEMP, 4000, 50
+        ),
+        "temperature, encode_temperature": lambda: encode_temperature(4000, 50),
+        "state, struct.unpack(format)": lambda: struct.unpack(">xxBBBBBBBhx6x", state),
+        "state, decode_notification": lambda: decode_notification(state),
+    }
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=NUMBER, repeat=5))
+        print(f"{name:<36} {seconds / NUMBER * 1e9:7.1f} ns/frame")
@@ -0,0 +1,73 @@
+""" colour conversions of the lights, precomputed or memoized """
+from __future__ import annotations
+
+from functools import lru_cache
+
+from homeassistant.util.color import color_hs_to_RGB, color_RGB_to_hs
+
+# Temperature range of the lamps (K), over which the scaling is precomputed:
+TEMPERATURE_MIN = 1700
+TEMPERATURE_MAX = 6500
+# the temp HA wants to set at when cliking on white in UI:
+HA_WHITE = 2740
+# the temp that correspond to true white on the lamp:
+LAMP_WHITE = 4080
+
+# Colours kept converted, enough for the scenes and slider drags in use:
+COLOR_CACHE_SIZE = 256
+
+
+def _scale_temp(temp: int) -> int:
+    a, b = TEMPERATURE_MIN, TEMPERATURE_MAX
+    mid, white = HA_WHITE, LAMP_WHITE
+    if temp < mid:
+        new_temp = (white - a) / (mid - a) * temp + a * (mid - white) / (mid - a)
+    else:
+        new_temp = (b - white) / (b - mid) * temp + b * (white - mid) / (b - mid)
+    return round(new_temp)
+
+
+def _scale_temp_reversed(temp: int) -> int:
+    a, b = TEMPERATURE_MIN, TEMPERATURE_MAX
+    mid, white = HA_WHITE, LAMP_WHITE
+    if temp < white:
+        new_temp = (mid - a) / (white - a) * temp - a * (mid - white) / (white - a)
+    else:
+        new_temp = (b - mid) / (b - white) * temp - b * (white - mid) / (b - white)
+    return round(new_temp)
+
+
+# Lookup tables indexed by the temperature minus TEMPERATURE_MIN:
+_TO_LAMP = tuple(
+    _scale_temp(temp) for temp in range(TEMPERATURE_MIN, TEMPERATURE_MAX + 1)
+)
+_TO_HA = tuple(
+    _scale_temp_reversed(temp) for temp in range(TEMPERATURE_MIN, TEMPERATURE_MAX + 1)
+)
+
+
+def scale_temp(temp: int) -> int:
+    """Scale a temperature from HA to the lamp, so that the white in HA UI
+    correspond to the white on the lamp!"""
+    index = temp - TEMPERATURE_MIN
+    if isinstance(index, int) and 0 <= index < len(_TO_LAMP):
+        return _TO_LAMP[index]
+    return _scale_temp(temp)
+
+
+def scale_temp_reversed(temp: int) -> int:
+    """Scale a temperature from the lamp back to HA"""
+    index = temp - TEMPERATURE_MIN
+    if isinstance(index, int) and 0 <= index < len(_TO_HA):
+        return _TO_HA[index]
+    return _scale_temp_reversed(temp)
+
+
+@lru_cache(maxsize=COLOR_CACHE_SIZE)
+def rgb_to_hs(red: int, green: int, blue: int) -> tuple[float, float]:
+    return color_RGB_to_hs(red, green, blue)
+
+
+@lru_cache(maxsize=COLOR_CACHE_SIZE)
+def hs_to_rgb(hue: float, saturation: float) -> tuple[int, int, int]:
+    return color_hs_to_RGB(hue, saturation)
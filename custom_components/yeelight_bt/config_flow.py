@@ -13,11 +13,27 @@ from homeassistant.components.bluetooth import (
 from homeassistant.components.bluetooth import BluetoothScanningMode
 from habluetooth.scanner import create_bleak_scanner
 from homeassistant.const import CONF_MAC, CONF_NAME
+from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.helpers import device_registry as dr
 
-from .const import CONF_ENTRY_MANUAL, CONF_ENTRY_METHOD, CONF_ENTRY_SCAN, DOMAIN
-from .yeelightbt import BleakError, discover_yeelight_lamps, model_from_name
+from .const import (
+    CONF_CONNECTION_POLICY,
+    CONF_ENTRY_MANUAL,
+    CONF_ENTRY_METHOD,
+    CONF_ENTRY_SCAN,
+    CONF_IDLE_TIMEOUT,
+    CONF_STATE_WRITE_INTERVAL,
+    DEFAULT_STATE_WRITE_INTERVAL,
+    DOMAIN,
+)
+from .yeelightbt import (
+    DEFAULT_IDLE_TIMEOUT,
+    BleakError,
+    ConnectionPolicy,
+    discover_yeelight_lamps,
+    model_from_name,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -28,6 +44,14 @@ class Yeelight_btConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):  # type:
     VERSION = 2
     CONNECTION_CLASS = config_entries.CONN_CLASS_LOCAL_POLL
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(
+        config_entry: config_entries.ConfigEntry,
+    ) -> config_entries.OptionsFlow:
+        """Get the options flow for this handler."""
+        return Yeelight_btOptionsFlow(config_entry)
+
     @property
     def data_schema(self) -> vol.Schema:
         """Return the data schema for integration."""
@@ -122,3 +146,41 @@ class Yeelight_btConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):  # type:
         self._abort_if_unique_id_configured()
 
         return self.async_create_entry(title=user_input[CONF_NAME], data=user_input)
+
+
+class Yeelight_btOptionsFlow(config_entries.OptionsFlow):
+    """Handle the options of a yeelight_bt entry."""
+
+    def __init__(self, config_entry: config_entries.ConfigEntry) -> None:
+        """Initialize options flow."""
+        self.config_entry = config_entry
+
+    async def async_step_init(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Manage the connection policy of the lamp."""
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        options = self.config_entry.options
+        schema = vol.Schema(
+            {
+                vol.Required(
+                    CONF_CONNECTION_POLICY,
+                    default=options.get(
+                        CONF_CONNECTION_POLICY, ConnectionPolicy.ALWAYS.value
+                    ),
+                ): vol.In([policy.value for policy in ConnectionPolicy]),
+                vol.Required(
+                    CONF_IDLE_TIMEOUT,
+                    default=options.get(CONF_IDLE_TIMEOUT, DEFAULT_IDLE_TIMEOUT),
+                ): vol.All(vol.Coerce(float), vol.Range(min=1)),
+                vol.Required(
+                    CONF_STATE_WRITE_INTERVAL,
+                    default=options.get(
+                        CONF_STATE_WRITE_INTERVAL, DEFAULT_STATE_WRITE_INTERVAL
+                    ),
+                ): vol.All(vol.Coerce(float), vol.Range(min=0)),
+            }
+        )
+        return self.async_show_form(step_id="init", data_schema=schema)
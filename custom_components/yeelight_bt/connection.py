@@ -0,0 +1,246 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Process-wide scheduling of the BLE connection slots shared by all lamps, and
+per lamp circuit breaker stopping the connection attempts to unreachable lamps.
+"""
+from __future__ import annotations
+
+# Standard imports
+import asyncio
+import enum
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Any
+
+# 3rd party imports
+from bleak import BleakError
+from bleak.backends.device import BLEDevice
+
+if TYPE_CHECKING:
+    from .yeelightbt import Lamp
+
+# BlueZ adapters and ESPHome proxies only hold a few concurrent connections:
+DEFAULT_MAX_CONNECTIONS = 3
+DEFAULT_ADAPTER = "default"
+
+# Circuit breaker: opened after this many connection failures in a row, for a
+# delay doubling at each new opening, within these bounds (seconds), +/- jitter:
+BREAKER_THRESHOLD = 2
+BREAKER_MIN_DELAY = 10.0
+BREAKER_MAX_DELAY = 600.0
+BREAKER_JITTER = 0.2
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def adapter_from_device(ble_device: BLEDevice) -> str:
+    """Return the name of the adapter (or proxy) a device is reached through"""
+    details = ble_device.details
+    if isinstance(details, dict):
+        # HA bluetooth (local adapters and proxies) gives the scanner source:
+        if details.get("source"):
+            return str(details["source"])
+        # bleak on BlueZ gives the dbus path: /org/bluez/hci0/dev_XX_XX...
+        path = details.get("path")
+        if isinstance(path, str) and path.startswith("/org/bluez/"):
+            return path.split("/")[3]
+    return DEFAULT_ADAPTER
+
+
+def is_bluez_client(client: Any) -> bool:
+    """True if the client talks to a local BlueZ adapter (not a proxy)"""
+    backend = getattr(client, "_backend", None)
+    return type(backend).__name__ == "BleakClientBlueZDBus"
+
+
+class ConnectionManager:
+    """Limit the number of lamps connected at once through each adapter.
+    When all slots of an adapter are taken, the least recently used idle lamp is
+    disconnected to make room. If none is idle, connect requests wait in line
+    (first come, first served) until a slot is released or a lamp becomes idle.
+    """
+
+    def __init__(self, max_connections: int = DEFAULT_MAX_CONNECTIONS) -> None:
+        self._max_connections = max_connections
+        self._limits: dict[str, int] = {}
+        # lamps holding a slot per adapter, least recently used first:
+        self._slots: dict[str, OrderedDict[str, Lamp]] = {}
+        self._adapter_of: dict[str, str] = {}
+        self._waiters: dict[str, deque[asyncio.Event]] = {}
+        self._stats = {"connects": 0, "evictions": 0, "waits": 0}
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Counters of slots granted, lamps evicted and connects that had to wait"""
+        return dict(self._stats)
+
+    def set_limit(self, adapter: str, max_connections: int) -> None:
+        """Set the number of connection slots of a given adapter"""
+        self._limits[adapter] = max_connections
+        self._wake_next(adapter)
+
+    def limit(self, adapter: str) -> int:
+        return self._limits.get(adapter, self._max_connections)
+
+    def connected(self, adapter: str) -> list[str]:
+        """Mac addresses of the lamps holding a slot, least recently used first"""
+        return list(self._slots.get(adapter, {}))
+
+    async def acquire(self, lamp: Lamp) -> None:
+        """Wait until the lamp holds a connection slot on its adapter"""
+        if lamp.mac in self._adapter_of:
+            self.touch(lamp)
+            return
+        adapter = adapter_from_device(lamp.ble_device)
+        slots = self._slots.setdefault(adapter, OrderedDict())
+        waiters = self._waiters.setdefault(adapter, deque())
+        waiter: asyncio.Event | None = None
+        try:
+            while True:
+                # only the head of the line may take a slot:
+                if not waiters or waiters[0] is waiter:
+                    if len(slots) < self.limit(adapter):
+                        break
+                    victim = self._idle_victim(slots, lamp)
+                    if victim is not None:
+                        _LOGGER.debug(f"Evicting {victim.mac} from {adapter}")
+                        self._stats["evictions"] += 1
+                        await victim.park()
+                        self.release(victim)
+                        continue
+                if waiter is None:
+                    self._stats["waits"] += 1
+                    waiter = asyncio.Event()
+                    waiters.append(waiter)
+                await waiter.wait()
+                waiter.clear()
+        finally:
+            if waiter is not None:
+                waiters.remove(waiter)
+                self._wake_next(adapter)
+        slots[lamp.mac] = lamp
+        self._adapter_of[lamp.mac] = adapter
+        self._stats["connects"] += 1
+
+    @staticmethod
+    def _idle_victim(slots: OrderedDict[str, Lamp], lamp: Lamp) -> Lamp | None:
+        for candidate in slots.values():
+            if candidate is not lamp and candidate.idle:
+                return candidate
+        return None
+
+    def release(self, lamp: Lamp) -> None:
+        """Give back the slot held by the lamp, if any"""
+        adapter = self._adapter_of.pop(lamp.mac, None)
+        if adapter is None:
+            return
+        self._slots[adapter].pop(lamp.mac, None)
+        self._wake_next(adapter)
+
+    def touch(self, lamp: Lamp) -> None:
+        """Mark the lamp as the most recently used of its adapter"""
+        adapter = self._adapter_of.get(lamp.mac)
+        if adapter is not None:
+            self._slots[adapter].move_to_end(lamp.mac)
+
+    def notify_idle(self, lamp: Lamp) -> None:
+        """Let a waiting connect request evict the lamp that just became idle"""
+        adapter = self._adapter_of.get(lamp.mac)
+        if adapter is not None:
+            self._wake_next(adapter)
+
+    def _wake_next(self, adapter: str) -> None:
+        waiters = self._waiters.get(adapter)
+        if waiters:
+            waiters[0].set()
+
+
+_CONNECTION_MANAGER = ConnectionManager()
+
+
+class LampUnreachableError(BleakError):
+    """The lamp is not connected, and is known not to be reachable right now"""
+
+
+class BreakerState(enum.Enum):
+    CLOSED = "closed"  # connections are attempted
+    OPEN = "open"  # connections fail fast, until the delay is over
+    HALF_OPEN = "half_open"  # the delay is over: one probe connection is allowed
+
+
+class CircuitBreaker:
+    """Stop attempting connections to a lamp which keeps failing to connect.
+    After BREAKER_THRESHOLD failures in a row, the breaker opens for a delay
+    growing exponentially with each opening. Once the delay is over, a single
+    connection attempt (the probe) closes it on success or opens it again.
+    """
+
+    def __init__(
+        self,
+        threshold: int = BREAKER_THRESHOLD,
+        min_delay: float = BREAKER_MIN_DELAY,
+        max_delay: float = BREAKER_MAX_DELAY,
+        jitter: float = BREAKER_JITTER,
+    ) -> None:
+        self._threshold = threshold
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._jitter = jitter
+        self._failures = 0  # in a row
+        self._openings = 0  # in a row, sets the delay
+        self._retry_at = 0.0  # monotonic time at which the open breaker half-opens
+        self._open = False
+
+    @property
+    def state(self) -> BreakerState:
+        if not self._open:
+            return BreakerState.CLOSED
+        if time.monotonic() < self._retry_at:
+            return BreakerState.OPEN
+        return BreakerState.HALF_OPEN
+
+    @property
+    def retry_in(self) -> float:
+        """Seconds until the next connection attempt is allowed"""
+        if not self._open:
+            return 0.0
+        return max(0.0, self._retry_at - time.monotonic())
+
+    def success(self) -> None:
+        self._failures = 0
+        self._openings = 0
+        self._open = False
+
+    def failure(self) -> None:
+        self._failures += 1
+        # a failed probe opens the breaker again straight away:
+        if self._open or self._failures >= self._threshold:
+            delay = min(self._max_delay, self._min_delay * 2**self._openings)
+            delay *= random.uniform(1 - self._jitter, 1 + self._jitter)
+            self._retry_at = time.monotonic() + delay
+            self._openings += 1
+            self._open = True
+
+    def close(self) -> None:
+        """Allow connections again before the end of the delay (e.g. the lamp
+        is back in range). The next failure opens it again for a longer delay.
+        """
+        self._open = False
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "state": self.state.value,
+            "failures": self._failures,
+            "openings": self._openings,
+            "retry_in": round(self.retry_in, 1),
+        }
+
+
+def get_connection_manager() -> ConnectionManager:
+    """Return the connection manager shared by all lamps of the process"""
+    return _CONNECTION_MANAGER
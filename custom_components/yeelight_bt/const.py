@@ -4,6 +4,31 @@
 
 DOMAIN = "yeelight_bt"
 PLATFORM = "light"
+PLATFORMS = ["light", "sensor"]
 CONF_ENTRY_METHOD = "entry_method"
 CONF_ENTRY_SCAN = "Scan"
 CONF_ENTRY_MANUAL = "Enter MAC manually"
+CONF_CONNECTION_POLICY = "connection_policy"
+CONF_IDLE_TIMEOUT = "idle_timeout"
+CONF_STATE_WRITE_INTERVAL = "state_write_interval"
+DATA_COORDINATOR = "coordinator"
+DATA_STORE = "store"
+DATA_SNAPSHOTS = "snapshots"
+SERVICE_SET_GROUP = "set_group"
+SERVICE_SNAPSHOT = "snapshot"
+SERVICE_RESTORE = "restore"
+
+# Persistence of the lamps identity and last state:
+STORAGE_KEY = f"{DOMAIN}.lamps"
+STORAGE_VERSION = 1
+STORAGE_SAVE_DELAY = 30  # seconds, the pending data is also saved when HA stops
+
+# State refresh of the lamps:
+REFRESH_INTERVAL = 30  # seconds between two refreshes of a lamp, at start
+MIN_REFRESH_INTERVAL = 5  # after user activity, a disconnection or a change
+MAX_REFRESH_INTERVAL = 600  # ceiling while the state of the lamp is stable
+REFRESH_BACKOFF = 2  # interval growth each time the state is found unchanged
+MAX_PARALLEL_REFRESH = 2  # lamps refreshed at the same time
+
+# Minimum seconds between two state writes of a light (0: write every change):
+DEFAULT_STATE_WRITE_INTERVAL = 0.0
@@ -0,0 +1,40 @@
+""" diagnostics download of a lamp """
+from __future__ import annotations
+
+import base64
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_MAC
+from homeassistant.core import HomeAssistant
+
+from .connection import get_connection_manager
+from .const import DATA_COORDINATOR, DOMAIN
+from .trace import format_records
+from .yeelightbt import Lamp
+
+TO_REDACT = {CONF_MAC, "serial"}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return the diagnostics of a config entry."""
+    lamp: Lamp = hass.data[DOMAIN][entry.entry_id]
+    coordinator = hass.data[DOMAIN][DATA_COORDINATOR]
+    return {
+        "entry": {
+            "data": async_redact_data(entry.data, TO_REDACT),
+            "options": dict(entry.options),
+        },
+        "lamp": async_redact_data(lamp.diagnostics(), TO_REDACT),
+        "refresh_interval": coordinator.interval(lamp),
+        "connection_manager": get_connection_manager().stats,
+        "trace": {
+            "recorded": lamp.trace.recorded,
+            "frames": format_records(lamp.trace.records()),
+            # binary form, read by the replay tool:
+            "binary": base64.b64encode(lamp.trace.dump()).decode(),
+        },
+    }
@@ -0,0 +1,201 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Light effects played by streaming precomputed frames to the lamps.
+Each effect is compiled once (per brightness) into a single buffer of frames,
+so playing it on many lamps costs no packing nor colour maths per frame.
+"""
+from __future__ import annotations
+
+# Standard imports
+import asyncio
+import colorsys
+import functools
+import logging
+import math
+import random
+from typing import TYPE_CHECKING, Callable, NamedTuple
+
+from .codec import (
+    FRAME_SIZE,
+    encode_brightness_into,
+    encode_color_into,
+    encode_temperature_into,
+)
+from .yeelightbt import MODEL_CANDELA
+
+if TYPE_CHECKING:
+    from .yeelightbt import Lamp
+
+EFFECT_COLORLOOP = "colorloop"
+EFFECT_BREATHE = "breathe"
+EFFECT_CANDLE = "candle"
+EFFECT_SUNRISE = "sunrise"
+
+_BLANK_FRAME = bytes(FRAME_SIZE)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Effect(NamedTuple):
+    """A compiled effect: frames of FRAME_SIZE bytes, written every interval"""
+
+    name: str
+    frames: bytes
+    interval: float
+    loop: bool
+    # start each lamp at a random frame so that they do not play in sync:
+    random_start: bool = False
+
+    @property
+    def frame_count(self) -> int:
+        return len(self.frames) // FRAME_SIZE
+
+
+class _FrameBuffer:
+    """Buffer an effect is compiled into, one frame after the other"""
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+
+    def _next(self) -> int:
+        offset = len(self.buffer)
+        self.buffer.extend(_BLANK_FRAME)
+        return offset
+
+    def brightness(self, brightness: float) -> None:
+        encode_brightness_into(self.buffer, self._next(), round(brightness))
+
+    def temperature(self, kelvin: float, brightness: float) -> None:
+        encode_temperature_into(
+            self.buffer, self._next(), round(kelvin), round(brightness)
+        )
+
+    def color(self, rgb: tuple[float, float, float], brightness: float) -> None:
+        red, green, blue = (round(255 * c) for c in rgb)
+        encode_color_into(
+            self.buffer, self._next(), red, green, blue, round(brightness)
+        )
+
+
+def _colorloop(frames: _FrameBuffer, brightness: int, color: bool) -> None:
+    """Cycle through the hues, one turn per minute"""
+    for i in range(60):
+        frames.color(colorsys.hsv_to_rgb(i / 60, 1, 1), brightness)
+
+
+def _breathe(frames: _FrameBuffer, brightness: int, color: bool) -> None:
+    """Slowly fade between a tenth of the brightness and the brightness"""
+    low = max(1, brightness / 10)
+    for i in range(20):
+        frames.brightness(
+            low + (brightness - low) * (1 - math.cos(math.pi * i / 10)) / 2
+        )
+
+
+def _candle(frames: _FrameBuffer, brightness: int, color: bool) -> None:
+    """Warm light flickering around the brightness"""
+    rand = random.Random(EFFECT_CANDLE)
+    for _ in range(96):
+        level = max(1, min(100, brightness * rand.uniform(0.6, 1.0)))
+        if color:
+            frames.temperature(1700, level)
+        else:
+            frames.brightness(level)
+
+
+def _sunrise(frames: _FrameBuffer, brightness: int, color: bool) -> None:
+    """Rise from a dim warm glow to the brightness in daylight, in 5 minutes"""
+    for i in range(151):
+        progress = i / 150
+        level = max(1, brightness * progress**2)
+        if color:
+            frames.temperature(1700 + 3300 * progress, level)
+        else:
+            frames.brightness(level)
+
+
+class _Definition(NamedTuple):
+    build: Callable[[_FrameBuffer, int, bool], None]
+    interval: float
+    loop: bool
+    needs_color: bool
+    random_start: bool = False
+
+
+_EFFECTS = {
+    EFFECT_COLORLOOP: _Definition(_colorloop, 1.0, True, True),
+    EFFECT_BREATHE: _Definition(_breathe, 0.4, True, False),
+    EFFECT_CANDLE: _Definition(_candle, 0.25, True, False, True),
+    EFFECT_SUNRISE: _Definition(_sunrise, 2.0, False, False),
+}
+
+
+def effect_list(model: str) -> list[str]:
+    """Return the names of the effects a lamp model can play"""
+    color = model != MODEL_CANDELA
+    return [
+        name for name, effect in _EFFECTS.items() if color or not effect.needs_color
+    ]
+
+
+@functools.lru_cache(maxsize=64)
+def compile_effect(name: str, brightness: int, color: bool = True) -> Effect:
+    """Return the frames of an effect, compiled once per parameters"""
+    definition = _EFFECTS[name]
+    brightness = min(100, max(1, brightness))
+    frames = _FrameBuffer()
+    definition.build(frames, brightness, color)
+    return Effect(
+        name,
+        bytes(frames.buffer),
+        definition.interval,
+        definition.loop,
+        definition.random_start,
+    )
+
+
+async def play_effect(lamp: Lamp, effect: Effect) -> int:
+    """Write the frames of an effect to the lamp at their scheduled time.
+    Frames are scheduled from the start of the effect, so the effect does not
+    drift when writes are slow: frames whose time has passed are skipped.
+    Returns the number of frames written (looping effects run until cancelled).
+    """
+    loop = asyncio.get_running_loop()
+    if not lamp.is_on:
+        await lamp.turn_on()
+    frames = memoryview(effect.frames)
+    count = effect.frame_count
+    first = random.randrange(count) if effect.random_start else 0
+    start = loop.time()
+    written = 0
+    skipped = 0
+    last = first - 1
+    while True:
+        index = first + int((loop.time() - start) / effect.interval)
+        index = max(index, last + 1)
+        if not effect.loop and index >= count:
+            if last == count - 1:
+                break
+            index = count - 1  # always end on the last frame
+        skipped += index - last - 1
+        offset = (index % count) * FRAME_SIZE
+        await lamp.send_cmd(frames[offset : offset + FRAME_SIZE], coalesce=True)
+        written += 1
+        last = index
+        next_frame = start + (index - first + 1) * effect.interval
+        await asyncio.sleep(max(0.0, next_frame - loop.time()))
+    _LOGGER.debug(
+        f"{lamp.mac}: effect {effect.name} done, {written} frames written, "
+        f"{skipped} skipped"
+    )
+    return written
+
+
+def start_effect(lamp: Lamp, name: str, brightness: int) -> asyncio.Task[int]:
+    """Play an effect on the lamp in the background, until a command stops it"""
+    effect = compile_effect(name, brightness, lamp.model != MODEL_CANDELA)
+    _LOGGER.debug(f"{lamp.mac}: start effect {name} ({effect.frame_count} frames)")
+    return lamp.animate(play_effect(lamp, effect), name)
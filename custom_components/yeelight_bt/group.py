@@ -0,0 +1,182 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Commands to a group of lamps at once (scenes, light groups).
+Commanded one by one, the lamps of a group change one after the other, each
+waiting for its own connection and answers. Here the lamps are all connected
+first, as many at once as their adapter has connection slots, and their frames
+are then written concurrently, so that they change within a short time window.
+"""
+from __future__ import annotations
+
+# Standard imports
+import asyncio
+import logging
+import time
+from typing import Any, NamedTuple
+
+# 3rd party imports
+from bleak import BleakError
+
+from .connection import ConnectionManager, adapter_from_device, get_connection_manager
+from .scene import Scene, apply_scene
+from .yeelightbt import Lamp
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class LampResult(NamedTuple):
+    mac: str
+    success: bool
+    connect_time: float  # seconds spent connecting (0 if it was connected)
+    latency: float  # seconds from the group command to the lamp changing
+    error: str | None = None
+    frames: int = 0  # frames sent, only what differs from the lamp state
+
+
+class GroupResult(NamedTuple):
+    lamps: list[LampResult]
+    window: float  # seconds between the first and the last lamp changing
+    duration: float
+
+    def as_dict(self) -> dict[str, Any]:
+        """Durations in ms, for the service response and the logs"""
+        return {
+            "window_ms": round(self.window * 1000, 1),
+            "duration_ms": round(self.duration * 1000, 1),
+            "lamps": {
+                result.mac: {
+                    "success": result.success,
+                    "connect_ms": round(result.connect_time * 1000, 1),
+                    "latency_ms": round(result.latency * 1000, 1),
+                    "frames": result.frames,
+                    "error": result.error,
+                }
+                for result in self.lamps
+            },
+        }
+
+
+async def _connect(lamp: Lamp) -> tuple[float, str | None]:
+    """Connect the lamp if needed. Returns the time spent and the error if any"""
+    start = time.monotonic()
+    try:
+        await lamp.connect()
+    except (BleakError, asyncio.TimeoutError) as err:
+        return time.monotonic() - start, str(err) or type(err).__name__
+    if not lamp.connected:
+        return time.monotonic() - start, "failed to connect"
+    return time.monotonic() - start, None
+
+
+async def _apply(
+    lamp: Lamp,
+    targets: dict[str, Scene],
+    restore: bool,
+    start: float,
+    connect_time: float,
+) -> LampResult:
+    try:
+        frames = len(await apply_scene(lamp, targets[lamp.mac], restore))
+    except (BleakError, asyncio.TimeoutError) as err:
+        error = str(err) or type(err).__name__
+        return LampResult(
+            lamp.mac, False, connect_time, time.monotonic() - start, error
+        )
+    latency = time.monotonic() - start
+    if not lamp.connected:
+        return LampResult(lamp.mac, False, connect_time, latency, "disconnected")
+    if frames:
+        # the color and brightness frames are not notified back, share them now:
+        lamp.run_state_changed_cb()
+    return LampResult(lamp.mac, True, connect_time, latency, frames=frames)
+
+
+async def _send_wave(
+    lamps: list[Lamp], targets: dict[str, Scene], restore: bool, start: float
+) -> list[LampResult]:
+    """Connect the lamps, then command them all at once"""
+    connections = await asyncio.gather(*(_connect(lamp) for lamp in lamps))
+    results: list[LampResult] = []
+    ready: list[tuple[Lamp, float]] = []
+    for lamp, (connect_time, error) in zip(lamps, connections):
+        if error is None:
+            ready.append((lamp, connect_time))
+        else:
+            results.append(
+                LampResult(
+                    lamp.mac, False, connect_time, time.monotonic() - start, error
+                )
+            )
+    results.extend(
+        await asyncio.gather(
+            *(
+                _apply(lamp, targets, restore, start, connect_time)
+                for lamp, connect_time in ready
+            )
+        )
+    )
+    return results
+
+
+async def _send_adapter(
+    lamps: list[Lamp],
+    targets: dict[str, Scene],
+    restore: bool,
+    start: float,
+    slots: int,
+) -> list[LampResult]:
+    """Command the lamps of an adapter, in waves of as many as it can connect"""
+    results: list[LampResult] = []
+    for index in range(0, len(lamps), slots):
+        wave = lamps[index : index + slots]
+        results.extend(await _send_wave(wave, targets, restore, start))
+    return results
+
+
+async def send_group(
+    lamps: list[Lamp],
+    target: Scene | dict[str, Scene],
+    connection_manager: ConnectionManager | None = None,
+    restore: bool = False,
+) -> GroupResult:
+    """Apply the same settings to a group of lamps, as close in time as possible.
+    The lamps of each adapter are handled in waves of as many lamps as the
+    adapter has connection slots (connected lamps first), the adapters in
+    parallel. Unreachable lamps are reported without trying them.
+    The target is the same for all lamps, or per lamp mac address.
+    With restore, the target is a scene being restored (see scene.plan).
+    """
+    if isinstance(target, dict):
+        targets = target
+    else:
+        targets = {lamp.mac: target for lamp in lamps}
+    manager = connection_manager or get_connection_manager()
+    start = time.monotonic()
+    results: list[LampResult] = []
+    adapters: dict[str, list[Lamp]] = {}
+    for lamp in sorted(lamps, key=lambda lamp: not lamp.connected):
+        if not lamp.reachable:
+            results.append(LampResult(lamp.mac, False, 0.0, 0.0, "unreachable"))
+            continue
+        adapters.setdefault(adapter_from_device(lamp.ble_device), []).append(lamp)
+    per_adapter = await asyncio.gather(
+        *(
+            _send_adapter(
+                members, targets, restore, start, max(1, manager.limit(adapter))
+            )
+            for adapter, members in adapters.items()
+        )
+    )
+    duration = time.monotonic() - start
+    for adapter_results in per_adapter:
+        results.extend(adapter_results)
+    changed = [result.latency for result in results if result.success]
+    window = max(changed) - min(changed) if changed else 0.0
+    _LOGGER.debug(
+        f"Group command {target} to {len(lamps)} lamps: {len(changed)} changed "
+        f"within {window * 1000:.0f}ms, in {duration * 1000:.0f}ms"
+    )
+    return GroupResult(results, window, duration)
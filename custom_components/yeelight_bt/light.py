@@ -1,16 +1,20 @@
 """ light platform """
 from __future__ import annotations
 
-import asyncio
+import functools
 import logging
-from typing import TYPE_CHECKING, Any
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, TypeVar
 
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
-from homeassistant.components.light import (  # ATTR_EFFECT,; SUPPORT_EFFECT,
+from homeassistant.components.light import (
     ATTR_BRIGHTNESS,
     ATTR_COLOR_TEMP_KELVIN,
+    ATTR_EFFECT,
     ATTR_HS_COLOR,
+    ATTR_TRANSITION,
     ENTITY_ID_FORMAT,
     PLATFORM_SCHEMA,
     LightEntity,
@@ -19,10 +23,11 @@ from homeassistant.components.light import (  # ATTR_EFFECT,; SUPPORT_EFFECT,
 )
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import CONF_MAC, CONF_NAME, EVENT_HOMEASSISTANT_STOP
-from homeassistant.core import HomeAssistant
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.entity import generate_entity_id
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
-from homeassistant.util.color import color_hs_to_RGB, color_RGB_to_hs
+from homeassistant.helpers.event import async_call_later
 from homeassistant.util.color import (
     color_temperature_kelvin_to_mired as kelvin_to_mired,
 )
@@ -30,11 +35,24 @@ from homeassistant.util.color import (
     color_temperature_mired_to_kelvin as mired_to_kelvin,
 )
 
-from .const import DOMAIN
-from .yeelightbt import MODEL_CANDELA, BleakError, Lamp
+from .colors import hs_to_rgb, rgb_to_hs, scale_temp, scale_temp_reversed
+from .const import (
+    CONF_STATE_WRITE_INTERVAL,
+    DATA_COORDINATOR,
+    DEFAULT_STATE_WRITE_INTERVAL,
+    DOMAIN,
+)
+from .effects import effect_list, start_effect
+from .metrics import (
+    STATE_WRITE_RATE_LIMITED,
+    STATE_WRITE_UNCHANGED,
+    STATE_WRITE_WRITTEN,
+)
+from .scene import Scene, apply_scene
+from .yeelightbt import MODEL_CANDELA, BleakError, Lamp, LampUnreachableError
 
 if TYPE_CHECKING:
-    from bleak.backends.device import BLEDevice
+    from . import YeelightBTCoordinator
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     {
@@ -43,10 +61,27 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     }
 )
 
-LIGHT_EFFECT_LIST = ["flow", "none"]
+EFFECT_NONE = "none"
 
 _LOGGER = logging.getLogger(__name__)
 
+_T = TypeVar("_T")
+
+
+def _unreachable_as_error(
+    func: Callable[..., Awaitable[_T]]
+) -> Callable[..., Awaitable[_T]]:
+    """Report a command to an unreachable lamp as an error of the service call"""
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> _T:
+        try:
+            return await func(*args, **kwargs)
+        except LampUnreachableError as err:
+            raise HomeAssistantError(str(err)) from err
+
+    return wrapper
+
 
 async def async_setup_entry(
     hass: HomeAssistant,
@@ -59,34 +94,69 @@ async def async_setup_entry(
         f"with data:{config_entry.data}"
     )
     name = config_entry.data.get(CONF_NAME) or DOMAIN
-    ble_device = hass.data[DOMAIN][config_entry.entry_id]
-
-    entity = YeelightBT(name, ble_device)
+    lamp = hass.data[DOMAIN][config_entry.entry_id]
+    coordinator = hass.data[DOMAIN][DATA_COORDINATOR]
+
+    entity = YeelightBT(
+        name,
+        lamp,
+        coordinator,
+        config_entry.options.get(
+            CONF_STATE_WRITE_INTERVAL, DEFAULT_STATE_WRITE_INTERVAL
+        ),
+    )
     async_add_entities([entity])
 
+    async def _async_update_options(hass: HomeAssistant, entry: ConfigEntry) -> None:
+        entity.state_write_interval = entry.options.get(
+            CONF_STATE_WRITE_INTERVAL, DEFAULT_STATE_WRITE_INTERVAL
+        )
+
+    config_entry.async_on_unload(
+        config_entry.add_update_listener(_async_update_options)
+    )
+
 
 class YeelightBT(LightEntity):
     """Representation of a light."""
 
-    def __init__(self, name: str, ble_device: BLEDevice) -> None:
+    def __init__(
+        self,
+        name: str,
+        lamp: Lamp,
+        coordinator: YeelightBTCoordinator,
+        state_write_interval: float = DEFAULT_STATE_WRITE_INTERVAL,
+    ) -> None:
         """Initialize the light."""
         self._name = name
-        self._mac = ble_device.address
+        self._coordinator = coordinator
+        self._mac = lamp.mac
         self.entity_id = generate_entity_id(ENTITY_ID_FORMAT, self._name, [])
         self._is_on = False
         self._rgb = (0, 0, 0)
+        # derived from the rgb once per change, rather than on each read:
+        self._hs = rgb_to_hs(*self._rgb)
         self._ct = 0
         self._brightness = 0
-        self._effect_list = LIGHT_EFFECT_LIST
-        self._effect = "none"
+        self._effect_list = [*effect_list(lamp.model), EFFECT_NONE]
         self._available = False
+        # brightness to turn back on to after fading out:
+        self._restore_brightness: int | None = None
+        # the state is only written to HA when it changed, and at most once per
+        # state_write_interval seconds (the last change is written at its end):
+        self.state_write_interval = state_write_interval
+        self._published: tuple[Any, ...] | None = None
+        self._last_write = 0.0
+        self._pending_write: CALLBACK_TYPE | None = None
 
         _LOGGER.info(f"Initializing YeelightBT Entity: {self.name}, {self._mac}")
-        self._dev = Lamp(ble_device)
+        self._dev = lamp
         self._dev.add_callback_on_state_changed(self._status_cb)
         self._prop_min_max = self._dev.get_prop_min_max()
         self._attr_min_color_temp_kelvin = self._prop_min_max["temperature"]["min"]
         self._attr_max_color_temp_kelvin = self._prop_min_max["temperature"]["max"]
+        # start with the state restored from before the last restart, if any:
+        self._update_from_lamp()
 
     async def async_added_to_hass(self) -> None:
         """Run when entity about to be added to hass."""
@@ -95,14 +165,20 @@ class YeelightBT(LightEntity):
                 EVENT_HOMEASSISTANT_STOP, self.async_will_remove_from_hass
             )
         )
-        # schedule immediate refresh of lamp state:
-        self.async_schedule_update_ha_state(force_refresh=True)
+        # the coordinator connects the lamp in the background once it advertises.
+        # HA writes the state once the entity is added, changes are published
+        # from there:
+        self._published = self._published_state()
+        self._last_write = time.monotonic()
 
     async def async_will_remove_from_hass(self, event=None) -> None:
         """Run when entity will be removed from hass."""
         _LOGGER.debug("Running async_will_remove_from_hass")
+        if self._pending_write is not None:
+            self._pending_write()
+            self._pending_write = None
         try:
-            await self._dev.disconnect()
+            await self._dev.close()
         except BleakError:
             _LOGGER.debug(
                 f"Exception disconnecting from {self._dev._mac}", exc_info=True
@@ -136,8 +212,13 @@ class YeelightBT(LightEntity):
 
     @property
     def should_poll(self) -> bool:
-        """Polling needed for a updating status."""
-        return True
+        """The integration coordinator refreshes the state of all lamps."""
+        return False
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        """Return the effective state refresh interval of the lamp."""
+        return {"refresh_interval": self._coordinator.interval(self._dev)}
 
     @property
     def name(self) -> str:
@@ -160,27 +241,27 @@ class YeelightBT(LightEntity):
         return self._brightness
 
     @property
-    def hs_color(self) -> tuple[Any]:
+    def hs_color(self) -> tuple[float, float]:
         """
         Return the Hue and saturation color value.
-        Lamp has rgb => we calculate hs
+        Lamp has rgb => we calculate hs (when the rgb changes)
         """
-        return color_RGB_to_hs(*self._rgb)
+        return self._hs
 
     @property
     def color_temp(self) -> int:
         """Return the CT color temperature in Kelvin."""
         return self._attr_color_temp_kelvin
 
-    # @property
-    # def effect_list(self):
-    #     """Return the list of supported effects."""
-    #     return self._effect_list
+    @property
+    def effect_list(self) -> list[str]:
+        """Return the list of supported effects."""
+        return self._effect_list
 
-    # @property
-    # def effect(self):
-    #     """Return the current effect."""
-    #     return self._effect
+    @property
+    def effect(self) -> str:
+        """Return the current effect."""
+        return self._dev.effect or EFFECT_NONE
 
     @property
     def is_on(self) -> bool:
@@ -193,39 +274,108 @@ class YeelightBT(LightEntity):
         if self._dev.model == MODEL_CANDELA:
             return {ColorMode.BRIGHTNESS}
         return {ColorMode.COLOR_TEMP, ColorMode.HS}
-    
+
     @property
     def supported_features(self) -> int:
         """Return the supported features using LightEntityFeature."""
         return LightEntityFeature.TRANSITION | LightEntityFeature.EFFECT
-        
+
     @property
     def color_mode(self) -> str:
         """Return the current color mode of the light."""
         if self._ct > 0:
             return ColorMode.COLOR_TEMP
-        return ColorMode.HS        
+        return ColorMode.HS
 
     def _status_cb(self) -> None:
         _LOGGER.debug("Got state notification from the lamp")
+        self._update_from_lamp()
+        self._publish()
+
+    def _published_state(self) -> tuple[Any, ...]:
+        """What HA shows of the light, to tell when it really changed"""
+        return (
+            self._available,
+            self._is_on,
+            self._brightness,
+            self._rgb,
+            self._attr_color_temp_kelvin,
+            self.color_mode,
+            self.effect,
+        )
+
+    def _publish(self) -> None:
+        """Write the state to HA if it changed, within the rate limit"""
+        if self.hass is None:
+            return  # not added to HA (yet), nothing to write to
+        state_writes = self._dev.metrics.state_writes
+        published = self._published_state()
+        if published == self._published:
+            state_writes[STATE_WRITE_UNCHANGED] += 1
+            return
+        if self._published is None or published[0] != self._published[0]:
+            # availability changes are never delayed:
+            if self._pending_write is not None:
+                self._pending_write()
+                self._pending_write = None
+                state_writes[STATE_WRITE_RATE_LIMITED] += 1
+            self._write_state(published)
+            return
+        if self._pending_write is not None:
+            # merged into the pending write, which publishes the latest state:
+            state_writes[STATE_WRITE_RATE_LIMITED] += 1
+            return
+        delay = self._last_write + self.state_write_interval - time.monotonic()
+        if delay > 0:
+            self._pending_write = async_call_later(
+                self.hass, delay, self._write_pending
+            )
+            return
+        self._write_state(published)
+
+    @callback
+    def _write_pending(self, _now: datetime) -> None:
+        self._pending_write = None
+        published = self._published_state()
+        if published == self._published:
+            # changed back meanwhile
+            self._dev.metrics.state_writes[STATE_WRITE_UNCHANGED] += 1
+            return
+        self._write_state(published)
+
+    def _write_state(self, published: tuple[Any, ...]) -> None:
+        self._published = published
+        self._last_write = time.monotonic()
+        self._dev.metrics.state_writes[STATE_WRITE_WRITTEN] += 1
+        self.async_write_ha_state()
+
+    def _update_from_lamp(self) -> None:
         self._available = self._dev.available
         if not self._available:
-            self.async_write_ha_state()
             return
 
         self._brightness = int(round(255.0 * self._dev.brightness / 100))
         self._is_on = self._dev.is_on
         if self._dev.mode == self._dev.MODE_WHITE:
-            self._attr_color_temp_kelvin = int(self.scale_temp_reversed(self._dev.temperature))
-            self._rgb = (0, 0, 0)
+            self._attr_color_temp_kelvin = int(
+                self.scale_temp_reversed(self._dev.temperature)
+            )
+            self._set_rgb((0, 0, 0))
         else:
             self._ct = 0
-            self._rgb = self._dev.color
-        self.async_write_ha_state()
+            self._set_rgb(self._dev.color)
+
+    def _set_rgb(self, rgb: tuple[int, int, int]) -> None:
+        if rgb != self._rgb:
+            self._rgb = rgb
+            self._hs = rgb_to_hs(*rgb)
 
     async def async_update(self) -> None:
         # Note, update should only start fetching,
         # followed by asynchronous updates through notifications.
+        if self._dev.settling:
+            # a get_state now would stop the transition, keep assumed state
+            return
         try:
             _LOGGER.debug("Requesting an update of the lamp status")
             await self._dev.get_state()
@@ -233,96 +383,124 @@ class YeelightBT(LightEntity):
             _LOGGER.error(f"Fail requesting the light status. Got exception: {ex}")
             _LOGGER.debug("Yeelight_BT trace:", exc_info=True)
 
+    @_unreachable_as_error
     async def async_turn_on(self, **kwargs: int) -> None:
         """Turn the light on."""
         _LOGGER.debug(f"Trying to turn on. with ATTR:{kwargs}")
+        self._coordinator.notify_activity(self._dev)
 
         # First if brightness of dev to 0: turn off
         if ATTR_BRIGHTNESS in kwargs:
             brightness = kwargs[ATTR_BRIGHTNESS]
             if brightness == 0:
                 _LOGGER.debug("Lamp brightness to be set to 0... so turning off")
-                await self.async_turn_off()
+                await self.async_turn_off(**kwargs)
                 return
+        elif self._restore_brightness is not None:
+            brightness = kwargs[ATTR_BRIGHTNESS] = self._restore_brightness
         else:
             brightness = self._brightness
+        self._restore_brightness = None
         brightness_dev = int(round(brightness * 1.0 / 255 * 100))
 
-        # ATTR cannot be set while light is off, so turn it on first
-        if not self._is_on:
-            await self._dev.turn_on()
-            if any(
-                keyword in kwargs
-                for keyword in (ATTR_HS_COLOR, ATTR_COLOR_TEMP_KELVIN, ATTR_BRIGHTNESS)
-            ):
-                await asyncio.sleep(0.5)  # wait for the lamp to turn on
-        self._is_on = True
+        if kwargs.get(ATTR_TRANSITION):
+            self._start_transition(kwargs, brightness, brightness_dev)
+            return
 
-        if ATTR_HS_COLOR in kwargs and ColorMode.HS in self.supported_color_modes:
-            rgb: tuple[int, int, int] = color_hs_to_RGB(*kwargs.get(ATTR_HS_COLOR))
-            self._rgb = rgb
-            _LOGGER.debug(
-                f"Trying to set color RGB:{rgb} with brighntess:{brightness_dev}"
-            )
-            await self._dev.set_color(*rgb, brightness=brightness_dev)
-            # assuming new state before lamp update comes through:
-            self._brightness = brightness_dev
-            await asyncio.sleep(0.7)  # give time to transition before HA request update
+        if ATTR_EFFECT in kwargs:
+            # ATTR cannot be set while light is off, so turn it on first
+            # (turn_on returns once the lamp notified its new state)
+            if not self._is_on:
+                await self._dev.turn_on()
+            self._is_on = True
+            effect = str(kwargs[ATTR_EFFECT])
+            if effect in self._effect_list and effect != EFFECT_NONE:
+                _LOGGER.debug(f"Trying to play effect {effect}")
+                start_effect(self._dev, effect, brightness_dev)
+            else:
+                self._dev.stop_animation()
+            self._publish()
             return
 
-        if ATTR_COLOR_TEMP_KELVIN in kwargs and ColorMode.COLOR_TEMP in self.supported_color_modes:
+        # power on if off, then color or temperature with the brightness, or
+        # the brightness alone:
+        scene = Scene(brightness=brightness_dev if ATTR_BRIGHTNESS in kwargs else None)
+        if ATTR_HS_COLOR in kwargs and ColorMode.HS in self.supported_color_modes:
+            rgb: tuple[int, int, int] = hs_to_rgb(*kwargs[ATTR_HS_COLOR])
+            scene = scene._replace(rgb=rgb, brightness=brightness_dev)
+        elif (
+            ATTR_COLOR_TEMP_KELVIN in kwargs
+            and ColorMode.COLOR_TEMP in self.supported_color_modes
+        ):
             temp_in_k = kwargs[ATTR_COLOR_TEMP_KELVIN]
             scaled_temp_in_k = self.scale_temp(temp_in_k)
-            _LOGGER.debug(
-                f"Trying to set temp:{scaled_temp_in_k} with brightness:{brightness_dev}"
+            scene = scene._replace(
+                temperature=scaled_temp_in_k, brightness=brightness_dev
             )
-            await self._dev.set_temperature(scaled_temp_in_k, brightness=brightness_dev)
-            self._attr_color_temp_kelvin = temp_in_k
-            # assuming new state before lamp update comes through:
-            self._brightness = brightness_dev
-            await asyncio.sleep(0.7)  # give time to transition before HA request update
-            return
-
-        if ATTR_BRIGHTNESS in kwargs:
-            _LOGGER.debug(f"Trying to set brightness: {brightness_dev}")
-            await self._dev.set_brightness(brightness_dev)
-            # assuming new state before lamp update comes through:
-            self._brightness = int(round(float(brightness_dev) * 2.55))
-            await asyncio.sleep(0.7)  # give time to transition before HA request update
-            return
-
-        # if ATTR_EFFECT in kwargs:
-        #    self._effect = kwargs[ATTR_EFFECT]
+        _LOGGER.debug(f"Trying to set {scene}")
+        frames = await apply_scene(self._dev, scene)
+        # assuming the new state of the frames sent before lamp update comes
+        # through (set after the power on, whose notification still holds the
+        # previous settings):
+        for frame in frames:
+            self._is_on = True
+            if frame.brightness is not None:
+                self._brightness = brightness
+            if frame.rgb is not None:
+                self._set_rgb(frame.rgb)
+            elif frame.temperature is not None:
+                self._attr_color_temp_kelvin = kwargs[ATTR_COLOR_TEMP_KELVIN]
+        # not polled, HA does not write the state after the service call:
+        self._publish()
+
+    def _start_transition(
+        self, kwargs: dict[str, Any], brightness: int, brightness_dev: int
+    ) -> None:
+        """Fade to the requested settings in the background (not awaited)"""
+        rgb = None
+        temperature = None
+        if ATTR_HS_COLOR in kwargs and ColorMode.HS in self.supported_color_modes:
+            rgb = hs_to_rgb(*kwargs[ATTR_HS_COLOR])
+            self._set_rgb(rgb)
+        elif (
+            ATTR_COLOR_TEMP_KELVIN in kwargs
+            and ColorMode.COLOR_TEMP in self.supported_color_modes
+        ):
+            temperature = self.scale_temp(kwargs[ATTR_COLOR_TEMP_KELVIN])
+            self._attr_color_temp_kelvin = kwargs[ATTR_COLOR_TEMP_KELVIN]
+        _LOGGER.debug(
+            f"Trying a {kwargs[ATTR_TRANSITION]}s transition to brightness:"
+            f"{brightness_dev}, RGB:{rgb}, temp:{temperature}"
+        )
+        self._dev.start_transition(
+            float(kwargs[ATTR_TRANSITION]),
+            brightness=brightness_dev,
+            rgb=rgb,
+            temperature=temperature,
+        )
+        # assuming the target state, the lamp notifies nothing while fading:
+        self._is_on = True
+        self._brightness = brightness
+        self._publish()
 
+    @_unreachable_as_error
     async def async_turn_off(self, **kwargs: int) -> None:
         """Turn the light off."""
-
-        await self._dev.turn_off()
+        self._coordinator.notify_activity(self._dev)
+        if kwargs.get(ATTR_TRANSITION) and self._is_on:
+            # the fade out leaves the lamp at its lowest brightness:
+            self._restore_brightness = self._brightness
+            self._dev.start_transition(float(kwargs[ATTR_TRANSITION]), turn_off=True)
+        else:
+            await self._dev.turn_off()
         self._is_on = False
+        self._publish()
 
     def scale_temp(self, temp: int) -> int:
         """Scale the temperature so that the white in HA UI correspond to the
         white on the lamp!"""
-        a = self._prop_min_max["temperature"]["min"]
-        b = self._prop_min_max["temperature"]["max"]
-        mid = 2740  # the temp HA wants to set at when cliking on white in UI
-        white = 4080  # the temp that correspond to true white on the lamp
-
-        if temp < mid:
-            new_temp = (white - a) / (mid - a) * temp + a * (mid - white) / (mid - a)
-        else:
-            new_temp = (b - white) / (b - mid) * temp + b * (white - mid) / (b - mid)
-        return round(new_temp)
+        return scale_temp(temp)
 
     def scale_temp_reversed(self, temp: int) -> int:
         """Reverse the scale to match HA UI"""
-        a = self._prop_min_max["temperature"]["min"]
-        b = self._prop_min_max["temperature"]["max"]
-        mid = 2740
-        white = 4080
-
-        if temp < white:
-            new_temp = (mid - a) / (white - a) * temp - a * (mid - white) / (white - a)
-        else:
-            new_temp = (b - mid) / (b - white) * temp - b * (white - mid) / (b - white)
-        return round(new_temp)
+        return scale_temp_reversed(temp)
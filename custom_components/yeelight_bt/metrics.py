@@ -0,0 +1,150 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Performance metrics of a lamp: counters and latency histograms.
+Recording is a few integer additions (and a bisect into a short tuple for the
+histograms), so the metrics are always collected.
+"""
+from __future__ import annotations
+
+# Standard imports
+from bisect import bisect_left
+from collections import Counter
+from typing import Any
+
+# Upper bounds of the histogram buckets (seconds), the last bucket is unbounded:
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Disconnect reasons:
+DISCONNECT_LOST = "lost"  # dropped by the lamp or the adapter
+DISCONNECT_IDLE = "idle"  # parked by the connection policy
+DISCONNECT_EVICTED = "evicted"  # parked to free the adapter for another lamp
+DISCONNECT_CLOSED = "closed"  # the lamp was closed
+DISCONNECT_REQUESTED = "requested"  # disconnect() called by the user of the lamp
+DISCONNECT_RECONNECT = "reconnect"  # dropped a stale client before reconnecting
+
+# Outcomes of a state update of the light entity:
+STATE_WRITE_WRITTEN = "written"  # written to HA
+STATE_WRITE_UNCHANGED = "unchanged"  # skipped, same as the state last written
+STATE_WRITE_RATE_LIMITED = "rate_limited"  # merged into a later write
+
+
+class Histogram:
+    """Distribution of durations (seconds) over fixed buckets"""
+
+    __slots__ = ("bounds", "buckets", "count", "total", "max")
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float | None:
+        return self.total / self.count if self.count else None
+
+    def percentile(self, quantile: float) -> float | None:
+        """Upper bound of the bucket holding the quantile [0-1] (None if empty).
+        Bounded by the largest value seen, which also stands for the last bucket.
+        """
+        if not self.count:
+            return None
+        rank = max(1, round(quantile * self.count))
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                break
+        if index < len(self.bounds):
+            return min(self.bounds[index], self.max)
+        return self.max
+
+    def as_dict(self) -> dict[str, Any]:
+        """Summary and buckets, in milliseconds"""
+        return {
+            "count": self.count,
+            "mean_ms": _ms(self.mean),
+            "p50_ms": _ms(self.percentile(0.5)),
+            "p95_ms": _ms(self.percentile(0.95)),
+            "max_ms": _ms(self.max if self.count else None),
+            "buckets": {
+                **{
+                    f"le_{bound * 1000:g}ms": count
+                    for bound, count in zip(self.bounds, self.buckets)
+                },
+                "inf": self.buckets[-1],
+            },
+        }
+
+
+def _ms(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """p50 and p99 of durations in seconds, returned in milliseconds"""
+    if not values:
+        return {"count": 0, "p50": 0.0, "p99": 0.0}
+    ordered = sorted(values)
+    last = len(ordered) - 1
+    return {
+        "count": len(ordered),
+        "p50": round(ordered[round(0.50 * last)] * 1000, 3),
+        "p99": round(ordered[round(0.99 * last)] * 1000, 3),
+    }
+
+
+class LampMetrics:
+    """Counters and histograms collected by a lamp"""
+
+    __slots__ = (
+        "connect_attempts",
+        "connect_failures",
+        "connect_time",
+        "pairing_time",
+        "write_latency",
+        "response_latency",
+        "notifications",
+        "disconnects",
+        "state_writes",
+    )
+
+    def __init__(self) -> None:
+        self.connect_attempts = 0
+        self.connect_failures = 0
+        # from the start of a connection to the end of the handshake:
+        self.connect_time = Histogram()
+        # from the pairing request to the lamp accepting it:
+        self.pairing_time = Histogram()
+        # time for a frame to be written (GATT write):
+        self.write_latency = Histogram()
+        # time for a query to be answered, from its write:
+        self.response_latency = Histogram()
+        self.notifications = 0
+        self.disconnects: Counter[str] = Counter()
+        # state updates of the light entity, by outcome (STATE_WRITE_*):
+        self.state_writes: Counter[str] = Counter()
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "connect_attempts": self.connect_attempts,
+            "connect_failures": self.connect_failures,
+            "connect_time": self.connect_time.as_dict(),
+            "pairing_time": self.pairing_time.as_dict(),
+            "write_latency": self.write_latency.as_dict(),
+            "response_latency": self.response_latency.as_dict(),
+            "notifications": self.notifications,
+            "disconnects": dict(self.disconnects),
+            "state_writes": dict(self.state_writes),
+        }
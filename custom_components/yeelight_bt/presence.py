@@ -0,0 +1,59 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Presence of a lamp, from its advertisements.
+Knowing whether a lamp is in range costs nothing this way, where trying to
+connect to it costs seconds of adapter time when it is not.
+"""
+from __future__ import annotations
+
+# Standard imports
+import time
+
+# Seconds without advertisement before a lamp is assumed out of range (HA
+# bluetooth usually tells it earlier, from the advertising interval it saw):
+PRESENCE_TIMEOUT = 900.0
+
+
+class Presence:
+    """When a lamp was last seen advertising, and how strong its signal was.
+    Until tracking starts (e.g. without HA bluetooth), the lamp is assumed to
+    be in range.
+    """
+
+    __slots__ = ("tracking", "timeout", "last_seen", "rssi")
+
+    def __init__(self, timeout: float = PRESENCE_TIMEOUT) -> None:
+        self.tracking = False
+        self.timeout = timeout
+        self.last_seen: float | None = None  # monotonic time
+        self.rssi: int | None = None
+
+    def start_tracking(self) -> None:
+        """Only consider the lamp in range once it is seen advertising"""
+        self.tracking = True
+
+    def seen(self, rssi: int | None = None) -> None:
+        self.last_seen = time.monotonic()
+        if rssi is not None:
+            self.rssi = rssi
+
+    def lost(self) -> None:
+        self.last_seen = None
+
+    @property
+    def present(self) -> bool:
+        if not self.tracking:
+            return True
+        if self.last_seen is None:
+            return False
+        return time.monotonic() - self.last_seen < self.timeout
+
+    @property
+    def age(self) -> float | None:
+        """Seconds since the lamp was last seen (None if not seen)"""
+        if self.last_seen is None:
+            return None
+        return time.monotonic() - self.last_seen
@@ -0,0 +1,166 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Replay of a captured frame trace, for offline performance regression checks.
+The trace is read from a diagnostics download, or from a binary trace file.
+By default the notifications of the trace are fed to Lamp.notification_handler
+as fast as possible; with --simulate the frames written to the lamp are sent
+again, at their recorded pace, to a simulated lamp:
+
+    python -m custom_components.yeelight_bt.replay diagnostics.json
+    python -m custom_components.yeelight_bt.replay trace.bin --simulate
+"""
+from __future__ import annotations
+
+# Standard imports
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import time
+from collections import Counter
+from typing import Any
+
+from .codec import (
+    CMD_GETNAME,
+    CMD_GETSERIAL,
+    CMD_GETSTATE,
+    CMD_GETVER,
+    CMD_PAIR,
+    RES_GETNAME,
+    RES_GETSERIAL,
+    RES_GETSTATE,
+    RES_GETVER,
+)
+from .metrics import percentiles
+from .simulator import Simulator
+from .trace import DIRECTION_IN, DIRECTION_OUT, TraceRecord, iter_records
+from .yeelightbt import MODEL_BEDSIDE, MODEL_CANDELA, Lamp
+
+# Notification answering each query, so that replayed queries wait for it:
+_RESPONSES = {
+    CMD_GETSTATE: RES_GETSTATE,
+    CMD_GETNAME: RES_GETNAME,
+    CMD_GETVER: RES_GETVER,
+    CMD_GETSERIAL: RES_GETSERIAL,
+}
+
+
+def load_trace(path: str) -> list[TraceRecord]:
+    """Read the records of a diagnostics download or of a binary trace"""
+    with open(path, "rb") as file:
+        data = file.read()
+    if data[:1] == b"{":
+        diagnostics = json.loads(data)
+        # the diagnostics download wraps the data of the integration:
+        diagnostics = diagnostics.get("data", diagnostics)
+        data = base64.b64decode(diagnostics["trace"]["binary"])
+    return list(iter_records(data))
+
+
+def replay_notifications(
+    records: list[TraceRecord], model: str, repeat: int
+) -> dict[str, Any]:
+    """Feed the notifications of a trace to a lamp, as fast as possible"""
+    simulator = Simulator()
+    lamp = Lamp(
+        simulator.add_lamp(model=model).ble_device,
+        connector=simulator.establish_connection,
+    )
+    notifications = [
+        bytearray(record.frame)
+        for record in records
+        if record.direction == DIRECTION_IN
+    ]
+    handler = lamp.notification_handler
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for notification in notifications:
+            handler(0, notification)
+    elapsed = time.perf_counter() - start
+    count = len(notifications) * repeat
+    types = Counter(f"0x{frame[1]:02x}" for frame in notifications if len(frame) > 1)
+    return {
+        "notifications": count,
+        "types": dict(types),
+        "us_per_notification": round(elapsed / count * 1e6, 3) if count else 0.0,
+        "final_state": lamp.state._asdict(),
+    }
+
+
+async def replay_simulated(
+    records: list[TraceRecord], model: str, speed: float, latency: float
+) -> dict[str, Any]:
+    """Write the frames of a trace to a simulated lamp, at their recorded pace
+    (divided by speed, 0 for as fast as possible)
+    """
+    simulator = Simulator()
+    device = simulator.add_lamp(model=model, latency=latency)
+    lamp = Lamp(device.ble_device, connector=simulator.establish_connection)
+    await lamp.connect()
+    loop = asyncio.get_running_loop()
+    # the handshake of the connection is replayed by connect:
+    frames = [
+        record
+        for record in records
+        if record.direction == DIRECTION_OUT and record.frame[1:2] != bytes([CMD_PAIR])
+    ]
+    latencies: list[float] = []
+    written = 0
+    start = loop.time()
+    for record in frames:
+        if speed > 0:
+            due = start + (record.time - frames[0].time) / speed
+            await asyncio.sleep(max(0.0, due - loop.time()))
+        sent = loop.time()
+        if await lamp.send_cmd(record.frame, response=_RESPONSES.get(record.frame[1])):
+            written += 1
+        latencies.append(loop.time() - sent)
+    elapsed = loop.time() - start
+    await lamp.close()
+    recorded = frames[-1].time - frames[0].time if frames else 0.0
+    return {
+        "frames": len(frames),
+        "written": written,
+        "latency": percentiles(latencies),
+        "recorded_s": round(recorded, 3),
+        "replayed_s": round(elapsed, 3),
+        "notifications": lamp.metrics.notifications,
+        "recorded_notifications": sum(
+            record.direction == DIRECTION_IN for record in records
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("trace", help="diagnostics download or binary trace file")
+    parser.add_argument(
+        "--model", choices=[MODEL_BEDSIDE, MODEL_CANDELA], default=MODEL_BEDSIDE
+    )
+    parser.add_argument(
+        "--simulate", action="store_true", help="replay the written frames instead"
+    )
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="simulated link latency (s)"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    records = load_trace(args.trace)
+    if args.simulate:
+        results = asyncio.run(
+            replay_simulated(records, args.model, args.speed, args.latency)
+        )
+    else:
+        results = replay_notifications(records, args.model, args.repeat)
+    print(json.dumps({"records": len(records), **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Scenes: settings captured from a lamp, and restored with as few frames as the
+difference with the current state of the lamp requires.
+Power on is only sent to a lamp that is off, and the brightness is merged into
+the color or temperature frame. When restoring a scene, the state of the lamp
+is read again if it is not recent, and the settings closer to the current ones
+than can be perceived are not sent at all, so that restoring a scene costs in
+time and radio traffic only what visibly changes.
+"""
+from __future__ import annotations
+
+# Standard imports
+import logging
+from typing import NamedTuple
+
+from .yeelightbt import MODEL_CANDELA, Lamp, LampState
+
+# Seconds a state is trusted to be compared with a restored scene:
+STATE_MAX_AGE = 5.0
+# Differences below which a restored setting is considered unchanged (not
+# perceived):
+BRIGHTNESS_THRESHOLD = 0.05  # relative to the brighter of the two
+COLOR_THRESHOLD = 3  # on each of the RGB channels [0-255]
+TEMPERATURE_THRESHOLD = 5  # mired
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Scene(NamedTuple):
+    """Settings of a lamp (None: unchanged).
+    The color takes precedence over the temperature, both are ignored by the
+    lamps that only support brightness.
+    """
+
+    is_on: bool = True
+    brightness: int | None = None  # [1-100]
+    rgb: tuple[int, int, int] | None = None
+    temperature: int | None = None  # K
+
+
+class SceneFrame(NamedTuple):
+    """A frame to send to the lamp, with the settings it carries"""
+
+    command: str  # "turn_on", "turn_off", "color", "temperature", "brightness"
+    brightness: int | None = None
+    rgb: tuple[int, int, int] | None = None
+    temperature: int | None = None
+
+
+def capture(lamp: Lamp) -> Scene:
+    """Scene of the current settings of the lamp"""
+    state = lamp.state
+    return Scene(
+        state.is_on,
+        state.brightness,
+        state.rgb if state.mode == Lamp.MODE_COLOR else None,
+        state.temperature if state.mode == Lamp.MODE_WHITE else None,
+    )
+
+
+def _mired(kelvin: int) -> float:
+    return 1_000_000 / max(kelvin, 1)
+
+
+def plan(
+    state: LampState | None, scene: Scene, restore: bool = False
+) -> list[SceneFrame]:
+    """Frames bringing a lamp from its state (None: unknown) to a scene.
+    Only when restoring are the settings compared with the state, to skip those
+    that differ too little to be seen: otherwise they are all sent.
+    """
+    # the settings of an explicit command are sent even if they match the
+    # state, which may be outdated (changed from the lamp or its app):
+    current = state if restore else None
+    if not scene.is_on:
+        if current is not None and not current.is_on:
+            return []
+        return [SceneFrame("turn_off")]
+    frames = []
+    # settings cannot be changed while the lamp is off:
+    if state is None or not state.is_on:
+        frames.append(SceneFrame("turn_on"))
+    if scene.rgb is not None:
+        if (
+            current is None
+            or current.mode != Lamp.MODE_COLOR
+            or max(abs(a - b) for a, b in zip(scene.rgb, current.rgb)) > COLOR_THRESHOLD
+        ):
+            frames.append(SceneFrame("color", scene.brightness, rgb=scene.rgb))
+            return frames
+    elif scene.temperature is not None:
+        if (
+            current is None
+            or current.mode != Lamp.MODE_WHITE
+            or abs(_mired(scene.temperature) - _mired(current.temperature))
+            > TEMPERATURE_THRESHOLD
+        ):
+            frames.append(
+                SceneFrame(
+                    "temperature", scene.brightness, temperature=scene.temperature
+                )
+            )
+            return frames
+    if scene.brightness is not None and (
+        current is None
+        or abs(scene.brightness - current.brightness)
+        > BRIGHTNESS_THRESHOLD * max(scene.brightness, current.brightness)
+    ):
+        frames.append(SceneFrame("brightness", scene.brightness))
+    return frames
+
+
+async def apply_scene(
+    lamp: Lamp, scene: Scene, restore: bool = False
+) -> list[SceneFrame]:
+    """Bring the lamp to the scene with the fewest frames (see plan).
+    Returns the frames sent (none when a restored lamp is already there).
+    """
+    if lamp.model == MODEL_CANDELA:
+        scene = scene._replace(rgb=None, temperature=None)
+    # as any command would, even if no frame ends up being sent:
+    lamp.stop_animation()
+    if lamp.mode is None and lamp.reachable:
+        # the state is unknown: it is read when connecting
+        await lamp.connect()
+    elif restore and lamp.state_age > STATE_MAX_AGE and lamp.reachable:
+        # the scene is compared with the state, which may have changed since:
+        await lamp.get_state()
+    state = lamp.state if lamp.mode is not None else None
+    frames = plan(state, scene, restore)
+    _LOGGER.debug(f"{lamp.mac}: {state} to {scene} in {len(frames)} frames")
+    for frame in frames:
+        if frame.command == "turn_on":
+            await lamp.turn_on()
+        elif frame.command == "turn_off":
+            await lamp.turn_off()
+        elif frame.command == "color" and frame.rgb is not None:
+            await lamp.set_color(*frame.rgb, brightness=frame.brightness)
+        elif frame.command == "temperature" and frame.temperature is not None:
+            await lamp.set_temperature(frame.temperature, frame.brightness)
+        elif frame.command == "brightness" and frame.brightness is not None:
+            await lamp.set_brightness(frame.brightness)
+    return frames
@@ -0,0 +1,198 @@
+""" sensor platform: diagnostic metrics of the lamps """
+from __future__ import annotations
+
+import logging
+import math
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Callable
+
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorEntityDescription,
+    SensorStateClass,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import (
+    CONF_NAME,
+    SIGNAL_STRENGTH_DECIBELS_MILLIWATT,
+    EntityCategory,
+    UnitOfTime,
+)
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity import DeviceInfo
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.typing import StateType
+
+from .const import DOMAIN
+from .metrics import STATE_WRITE_WRITTEN, Histogram
+from .yeelightbt import Lamp
+
+# The metrics are read from memory, polling them costs nothing on the lamps:
+SCAN_INTERVAL = timedelta(seconds=60)
+PARALLEL_UPDATES = 0
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, kw_only=True)
+class YeelightBTSensorEntityDescription(SensorEntityDescription):
+    """Describes a metric of the lamp exposed as a sensor"""
+
+    value_fn: Callable[[Lamp], StateType]
+    attributes_fn: Callable[[Lamp], dict[str, Any]] | None = None
+
+
+def _summary(histogram: Histogram) -> dict[str, Any]:
+    """Histogram summary, without the buckets"""
+    summary = histogram.as_dict()
+    summary.pop("buckets")
+    return summary
+
+
+def _p50_ms(histogram: Histogram) -> float | None:
+    median = histogram.percentile(0.5)
+    return None if median is None else round(median * 1000, 1)
+
+
+def _state_age(lamp: Lamp) -> float | None:
+    age = lamp.state_age
+    return None if math.isinf(age) else round(age)
+
+
+def _latency_sensor(
+    key: str, name: str, histogram: Callable[[Lamp], Histogram]
+) -> YeelightBTSensorEntityDescription:
+    """Median of a latency histogram, with its summary as attributes"""
+    return YeelightBTSensorEntityDescription(
+        key=key,
+        name=name,
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda lamp: _p50_ms(histogram(lamp)),
+        attributes_fn=lambda lamp: _summary(histogram(lamp)),
+    )
+
+
+SENSORS: tuple[YeelightBTSensorEntityDescription, ...] = (
+    _latency_sensor(
+        "connect_time", "Connect time", lambda lamp: lamp.metrics.connect_time
+    ),
+    _latency_sensor(
+        "pairing_time", "Pairing time", lambda lamp: lamp.metrics.pairing_time
+    ),
+    _latency_sensor(
+        "write_latency", "Write latency", lambda lamp: lamp.metrics.write_latency
+    ),
+    _latency_sensor(
+        "response_latency",
+        "Response latency",
+        lambda lamp: lamp.metrics.response_latency,
+    ),
+    YeelightBTSensorEntityDescription(
+        key="connect_attempts",
+        name="Connect attempts",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda lamp: lamp.metrics.connect_attempts,
+        attributes_fn=lambda lamp: {"failures": lamp.metrics.connect_failures},
+    ),
+    YeelightBTSensorEntityDescription(
+        key="disconnects",
+        name="Disconnects",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda lamp: sum(lamp.metrics.disconnects.values()),
+        attributes_fn=lambda lamp: dict(lamp.metrics.disconnects),
+    ),
+    YeelightBTSensorEntityDescription(
+        key="notifications",
+        name="Notifications",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda lamp: lamp.metrics.notifications,
+    ),
+    YeelightBTSensorEntityDescription(
+        key="state_age",
+        name="State age",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.SECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=_state_age,
+    ),
+    YeelightBTSensorEntityDescription(
+        key="rssi",
+        name="Signal strength",
+        device_class=SensorDeviceClass.SIGNAL_STRENGTH,
+        native_unit_of_measurement=SIGNAL_STRENGTH_DECIBELS_MILLIWATT,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda lamp: lamp.presence.rssi,
+        attributes_fn=lambda lamp: {"in_range": lamp.in_range},
+    ),
+    YeelightBTSensorEntityDescription(
+        key="dropped_commands",
+        name="Dropped commands",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda lamp: lamp.command_stats["dropped"],
+        attributes_fn=lambda lamp: lamp.command_stats,
+    ),
+    YeelightBTSensorEntityDescription(
+        key="state_writes_avoided",
+        name="State writes avoided",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda lamp: sum(
+            count
+            for outcome, count in lamp.metrics.state_writes.items()
+            if outcome != STATE_WRITE_WRITTEN
+        ),
+        attributes_fn=lambda lamp: dict(lamp.metrics.state_writes),
+    ),
+    YeelightBTSensorEntityDescription(
+        key="coalesced_commands",
+        name="Coalesced commands",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda lamp: lamp.command_stats["coalesced"],
+    ),
+)
+
+
+async def async_setup_entry(
+    hass: HomeAssistant,
+    config_entry: ConfigEntry,
+    async_add_entities: AddEntitiesCallback,
+) -> None:
+    """Set up the diagnostic sensors of a lamp from config_entry."""
+    name = config_entry.data.get(CONF_NAME) or DOMAIN
+    lamp = hass.data[DOMAIN][config_entry.entry_id]
+    async_add_entities(
+        YeelightBTSensor(name, lamp, description) for description in SENSORS
+    )
+
+
+class YeelightBTSensor(SensorEntity):
+    """A performance metric of a lamp."""
+
+    entity_description: YeelightBTSensorEntityDescription
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(
+        self, name: str, lamp: Lamp, description: YeelightBTSensorEntityDescription
+    ) -> None:
+        """Initialize the sensor."""
+        self.entity_description = description
+        self._dev = lamp
+        self._attr_name = f"{name} {description.name}"
+        self._attr_unique_id = f"{lamp.mac}_{description.key}"
+        # attached to the device of the light:
+        self._attr_device_info = DeviceInfo(identifiers={(DOMAIN, lamp.mac)})
+
+    @property
+    def native_value(self) -> StateType:
+        """Return the current value of the metric."""
+        return self.entity_description.value_fn(self._dev)
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any] | None:
+        """Return the details of the metric."""
+        if self.entity_description.attributes_fn is None:
+            return None
+        return self.entity_description.attributes_fn(self._dev)
@@ -0,0 +1,183 @@
+""" services of the integration """
+from __future__ import annotations
+
+import logging
+
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
+from homeassistant.components.light import (
+    ATTR_BRIGHTNESS_PCT,
+    ATTR_COLOR_TEMP_KELVIN,
+    ATTR_RGB_COLOR,
+)
+from homeassistant.components.light import DOMAIN as LIGHT_DOMAIN
+from homeassistant.const import ATTR_STATE
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+)
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.service import async_extract_entity_ids
+
+from .colors import scale_temp
+from .const import (
+    DATA_COORDINATOR,
+    DATA_SNAPSHOTS,
+    DOMAIN,
+    SERVICE_RESTORE,
+    SERVICE_SET_GROUP,
+    SERVICE_SNAPSHOT,
+)
+from .group import GroupResult, send_group
+from .scene import Scene, capture
+from .yeelightbt import Lamp
+
+_LOGGER = logging.getLogger(__name__)
+
+SET_GROUP_SCHEMA = cv.make_entity_service_schema(
+    {
+        vol.Optional(ATTR_STATE, default=True): cv.boolean,
+        vol.Optional(ATTR_BRIGHTNESS_PCT): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=100)
+        ),
+        vol.Exclusive(ATTR_RGB_COLOR, "color"): vol.All(
+            vol.Coerce(tuple), vol.ExactSequence((cv.byte,) * 3)
+        ),
+        vol.Exclusive(ATTR_COLOR_TEMP_KELVIN, "color"): cv.positive_int,
+    }
+)
+SNAPSHOT_SCHEMA = cv.make_entity_service_schema({})
+RESTORE_SCHEMA = cv.make_entity_service_schema({})
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Register the services, once for all the lamps"""
+    if hass.services.has_service(DOMAIN, SERVICE_SET_GROUP):
+        return
+
+    async def _async_set_group(call: ServiceCall) -> ServiceResponse:
+        return await async_set_group(hass, call)
+
+    async def _async_snapshot(call: ServiceCall) -> None:
+        await async_snapshot(hass, call)
+
+    async def _async_restore(call: ServiceCall) -> ServiceResponse:
+        return await async_restore(hass, call)
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_SET_GROUP,
+        _async_set_group,
+        schema=SET_GROUP_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_SNAPSHOT, _async_snapshot, schema=SNAPSHOT_SCHEMA
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_RESTORE,
+        _async_restore,
+        schema=RESTORE_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+
+
+def async_unload_services(hass: HomeAssistant) -> None:
+    for service in (SERVICE_SET_GROUP, SERVICE_SNAPSHOT, SERVICE_RESTORE):
+        hass.services.async_remove(DOMAIN, service)
+    hass.data[DOMAIN].pop(DATA_SNAPSHOTS, None)
+
+
+async def _async_target_lamps(
+    hass: HomeAssistant, call: ServiceCall
+) -> tuple[dict[str, Lamp], dict[str, str]]:
+    """The lamps targeted by a service call, and their entity id, by mac address"""
+    registry = er.async_get(hass)
+    lamps: dict[str, Lamp] = {}
+    entity_ids: dict[str, str] = {}
+    for entity_id in await async_extract_entity_ids(hass, call):
+        entity = registry.async_get(entity_id)
+        if entity is None or entity.platform != DOMAIN:
+            continue
+        if entity.domain != LIGHT_DOMAIN:
+            continue
+        lamp = hass.data[DOMAIN].get(entity.config_entry_id)
+        if isinstance(lamp, Lamp):
+            lamps[lamp.mac] = lamp
+            entity_ids[lamp.mac] = entity_id
+    if not lamps:
+        raise HomeAssistantError(f"No {DOMAIN} light among the targets")
+    return lamps, entity_ids
+
+
+def _response(
+    entity_ids: dict[str, str], result: GroupResult, command: str
+) -> ServiceResponse:
+    failed = [entity_ids[lamp.mac] for lamp in result.lamps if not lamp.success]
+    if failed:
+        _LOGGER.warning(f"{command} not applied to {', '.join(failed)}")
+    response = result.as_dict()
+    # reported per entity rather than per mac address:
+    response["lamps"] = {
+        entity_ids[mac]: lamp_result for mac, lamp_result in response["lamps"].items()
+    }
+    return response
+
+
+async def async_set_group(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    """Apply the same settings to all the targeted lamps at once.
+    Returns the time each lamp took to change.
+    """
+    lamps, entity_ids = await _async_target_lamps(hass, call)
+    temperature = call.data.get(ATTR_COLOR_TEMP_KELVIN)
+    if temperature is not None:
+        temperature = scale_temp(temperature)
+    rgb = call.data.get(ATTR_RGB_COLOR)
+    target = Scene(
+        is_on=call.data[ATTR_STATE],
+        brightness=call.data.get(ATTR_BRIGHTNESS_PCT),
+        rgb=tuple(rgb) if rgb is not None else None,
+        temperature=temperature,
+    )
+    coordinator = hass.data[DOMAIN][DATA_COORDINATOR]
+    for lamp in lamps.values():
+        coordinator.notify_activity(lamp)
+
+    result = await send_group(list(lamps.values()), target)
+    return _response(entity_ids, result, "Group command")
+
+
+async def async_snapshot(hass: HomeAssistant, call: ServiceCall) -> None:
+    """Capture the settings of the targeted lamps, to restore them later"""
+    lamps, entity_ids = await _async_target_lamps(hass, call)
+    snapshots: dict[str, Scene] = hass.data[DOMAIN].setdefault(DATA_SNAPSHOTS, {})
+    for mac, lamp in lamps.items():
+        if lamp.mode is None:
+            _LOGGER.warning(f"State of {entity_ids[mac]} unknown, not captured")
+            continue
+        snapshots[mac] = capture(lamp)
+
+
+async def async_restore(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    """Bring the targeted lamps back to their snapshot, all at once.
+    Only the settings that visibly differ from the current ones are sent.
+    Returns the time each lamp took to change.
+    """
+    lamps, entity_ids = await _async_target_lamps(hass, call)
+    snapshots: dict[str, Scene] = hass.data[DOMAIN].get(DATA_SNAPSHOTS, {})
+    for mac in [mac for mac in lamps if mac not in snapshots]:
+        _LOGGER.warning(f"No snapshot of {entity_ids[mac]} to restore")
+        del lamps[mac]
+    if not lamps:
+        raise HomeAssistantError("No snapshot of the targets to restore")
+    coordinator = hass.data[DOMAIN][DATA_COORDINATOR]
+    for lamp in lamps.values():
+        coordinator.notify_activity(lamp)
+
+    targets = {mac: snapshots[mac] for mac in lamps}
+    result = await send_group(list(lamps.values()), targets, restore=True)
+    return _response(entity_ids, result, "Restore")
@@ -0,0 +1,417 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Simulated lamps, to exercise Lamp without a real device nearby.
+A Simulator holds virtual lamps and replaces establish_connection: it returns
+clients implementing the part of BleakClient used by Lamp, talking to a model
+of the Bedside/Candela protocol (pairing, state notifications, transitions
+stopped by any incoming frame). Latency, packet loss, connection failures and
+disconnections can be injected.
+
+    sim = Simulator()
+    device = sim.add_lamp(latency=0.05, loss=0.01).ble_device
+    lamp = Lamp(device, connector=sim.establish_connection)
+"""
+from __future__ import annotations
+
+# Standard imports
+import asyncio
+import logging
+import random
+import struct
+from typing import Any, Callable, cast
+
+# 3rd party imports
+from bleak import BleakClient, BleakError
+from bleak.backends.device import BLEDevice
+
+from .codec import (
+    CMD_BRIGHTNESS,
+    CMD_COLOR,
+    CMD_GETNAME,
+    CMD_GETSERIAL,
+    CMD_GETSTATE,
+    CMD_GETVER,
+    CMD_PAIR,
+    CMD_POWER,
+    CMD_POWER_ON,
+    CMD_TEMP,
+    COMMAND_STX,
+    RES_GETNAME,
+    RES_GETSERIAL,
+    RES_GETSTATE,
+    RES_GETVER,
+    RES_PAIR,
+)
+from .yeelightbt import MODEL_BEDSIDE, MODEL_CANDELA, TRANSITION_SETTLE, Lamp
+
+# Pairing results sent by the lamps:
+PAIR_PUSH_BUTTON = 0x01
+PAIR_SUCCESS = 0x02
+PAIR_ALREADY_PAIRED = 0x04
+
+_BEDSIDE_STATE = struct.Struct(">BBBBBBBBBh7x")
+_CANDELA_STATE = struct.Struct("BBBBB13x")
+_BYTE_RESULT = struct.Struct("BBB15x")
+_VERSION = struct.Struct("BBBHHHH6x")  # native alignment, as the lamps send it
+_NAME = struct.Struct("BB16s")
+_TEMP = struct.Struct(">hB")
+_COLOR = struct.Struct("BBBxB")
+
+# transition in progress: start time, end time, start and end settings
+_Transition = tuple[float, float, tuple[Any, ...], tuple[Any, ...]]
+
+_NAME_PREFIX = {MODEL_BEDSIDE: "XMCTD_", MODEL_CANDELA: "yeelight_ms"}
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _SimulatedBackend:
+    """Stands for the bleak backend of a simulated client"""
+
+
+# Lamp checks the backend class name to apply the BlueZ specific handshakes:
+_SimulatedBlueZBackend = type("BleakClientBlueZDBus", (_SimulatedBackend,), {})
+
+
+class SimulatedLamp:
+    """Model of a lamp, answering the frames written to it"""
+
+    def __init__(
+        self,
+        simulator: Simulator,
+        address: str,
+        model: str = MODEL_BEDSIDE,
+        source: str = "simulator",
+        latency: float = 0.02,
+        jitter: float = 0.0,
+        loss: float = 0.0,
+        disconnect_rate: float = 0.0,
+        connect_latency: float = 0.1,
+        connect_failure: float = 0.0,
+        paired: bool = True,
+        auto_pair_delay: float | None = None,
+        transition_time: float = TRANSITION_SETTLE,
+        bluez: bool = True,
+    ) -> None:
+        self._simulator = simulator
+        self.address = address
+        self.model = model
+        self.ble_device = BLEDevice(
+            address,
+            f"{_NAME_PREFIX.get(model, '')}{address[-5:].replace(':', '')}",
+            {"source": source},
+        )
+        # injected faults, can be changed while running:
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.disconnect_rate = disconnect_rate
+        self.connect_latency = connect_latency
+        self.connect_failure = connect_failure
+        self.in_range = True
+        self.bluez = bluez
+        # protocol state:
+        self.paired = paired
+        self.pairing = False
+        self.auto_pair_delay = auto_pair_delay
+        self.transition_time = transition_time
+        self.is_on = False
+        self.mode = Lamp.MODE_WHITE
+        self.brightness = 50
+        self.rgb = (255, 255, 255)
+        self.temperature = 4000
+        self.name = self.ble_device.name or ""
+        self.version = (1, 2, 3, 4, 5)
+        self.serial = 1
+        self._transition: _Transition | None = None
+        self.client: SimulatedClient | None = None
+        self.stats = {
+            "connects": 0,
+            "connect_failures": 0,
+            "disconnections": 0,
+            "frames": 0,
+            "lost": 0,
+            "notifications": 0,
+            "interrupted": 0,
+        }
+
+    def _now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def _settings(self) -> tuple[Any, ...]:
+        return (self.brightness, self.temperature, self.rgb)
+
+    def _apply(self, settings: tuple[Any, ...]) -> None:
+        self.brightness, self.temperature, self.rgb = settings
+
+    def _blend(self, progress: float) -> tuple[Any, ...]:
+        assert self._transition is not None
+        _, _, start, end = self._transition
+        brightness = round(start[0] + (end[0] - start[0]) * progress)
+        temperature = round(start[1] + (end[1] - start[1]) * progress)
+        rgb = tuple(round(a + (b - a) * progress) for a, b in zip(start[2], end[2]))
+        return (brightness, temperature, rgb)
+
+    def _interrupt(self) -> None:
+        """Any frame stops the running transition where it is"""
+        if self._transition is None:
+            return
+        begin, end, _, _ = self._transition
+        now = self._now()
+        if now < end:
+            self.stats["interrupted"] += 1
+            self._apply(self._blend((now - begin) / (end - begin)))
+        else:
+            self._apply(self._transition[3])
+        self._transition = None
+
+    def _start_transition(self, settings: tuple[Any, ...]) -> None:
+        now = self._now()
+        self._transition = (now, now + self.transition_time, self._settings(), settings)
+
+    def current(self) -> tuple[int, int, tuple[int, ...]]:
+        """Brightness, temperature and color shown right now"""
+        if self._transition is None:
+            return cast(tuple[int, int, tuple[int, ...]], self._settings())
+        begin, end, _, target = self._transition
+        progress = min(1.0, (self._now() - begin) / (end - begin))
+        return cast(tuple[int, int, tuple[int, ...]], self._blend(progress))
+
+    def press_button(self) -> None:
+        """Push the pairing button of the lamp"""
+        if not self.pairing:
+            return
+        self.pairing = False
+        self.paired = True
+        if self.client is not None:
+            self.client.notify(_BYTE_RESULT.pack(COMMAND_STX, RES_PAIR, PAIR_SUCCESS))
+
+    def receive(self, frame: bytes) -> list[bytes]:
+        """Process a frame written to the lamp, return the notifications sent"""
+        self.stats["frames"] += 1
+        self._interrupt()
+        cmd = frame[1]
+        if cmd == CMD_PAIR:
+            return self._pair()
+        if not self.paired:
+            return []  # commands are ignored until the lamp is paired
+        if cmd == CMD_POWER:
+            self.is_on = frame[2] == CMD_POWER_ON
+            return [self._state()]
+        if cmd == CMD_GETSTATE:
+            return [self._state()]
+        if cmd == CMD_GETNAME:
+            return [_NAME.pack(COMMAND_STX, RES_GETNAME, self.name.encode())]
+        if cmd == CMD_GETVER:
+            return [_VERSION.pack(COMMAND_STX, RES_GETVER, *self.version)]
+        if cmd == CMD_GETSERIAL:
+            return [_BYTE_RESULT.pack(COMMAND_STX, RES_GETSERIAL, self.serial)]
+        if not self.is_on:
+            return []  # settings cannot be changed while off
+        brightness, temperature, rgb = self._settings()
+        if cmd == CMD_BRIGHTNESS:
+            brightness = frame[2]
+        elif cmd == CMD_TEMP and self.model != MODEL_CANDELA:
+            temperature, brightness = _TEMP.unpack_from(frame, 2)
+            self.mode = Lamp.MODE_WHITE
+        elif cmd == CMD_COLOR and self.model != MODEL_CANDELA:
+            red, green, blue, brightness = _COLOR.unpack_from(frame, 2)
+            rgb = (red, green, blue)
+            self.mode = Lamp.MODE_COLOR
+        else:
+            _LOGGER.debug(f"{self.address}: ignoring frame 0x{frame.hex()}")
+            return []
+        self._start_transition((brightness, temperature, rgb))
+        return []
+
+    def _pair(self) -> list[bytes]:
+        if self.model == MODEL_CANDELA:
+            self.paired = True  # Candela does not report on pairing
+            return []
+        if self.paired:
+            return [_BYTE_RESULT.pack(COMMAND_STX, RES_PAIR, PAIR_ALREADY_PAIRED)]
+        self.pairing = True
+        if self.auto_pair_delay is not None:
+            asyncio.get_running_loop().call_later(
+                self.auto_pair_delay, self.press_button
+            )
+        return [_BYTE_RESULT.pack(COMMAND_STX, RES_PAIR, PAIR_PUSH_BUTTON)]
+
+    def _state(self) -> bytes:
+        brightness, temperature, rgb = self.current()
+        power = 0x01 if self.is_on else 0x02
+        if self.model == MODEL_CANDELA:
+            return _CANDELA_STATE.pack(
+                COMMAND_STX, RES_GETSTATE, power, brightness, self.mode
+            )
+        return _BEDSIDE_STATE.pack(
+            COMMAND_STX,
+            RES_GETSTATE,
+            power,
+            self.mode,
+            *rgb,
+            0,
+            brightness,
+            temperature,
+        )
+
+    def disconnect(self) -> None:
+        """Drop the connection from the lamp side (e.g. out of range)"""
+        if self.client is not None:
+            self.client.drop()
+
+    def delay(self) -> float:
+        """Latency of one write or notification"""
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency + self._simulator.random.uniform(0, self.jitter))
+
+
+class SimulatedClient:
+    """The part of BleakClient that Lamp uses, connected to a SimulatedLamp"""
+
+    def __init__(
+        self,
+        lamp: SimulatedLamp,
+        disconnected_callback: Callable[[Any], None] | None = None,
+    ) -> None:
+        self._lamp = lamp
+        self._disconnected_callback = disconnected_callback
+        self._notify_callbacks: dict[str, Callable[[int, bytearray], None]] = {}
+        self._connected = True
+        self._backend = _SimulatedBlueZBackend() if lamp.bluez else _SimulatedBackend()
+        self.services: list[Any] = []
+
+    def __str__(self) -> str:
+        return f"SimulatedClient({self._lamp.address})"
+
+    @property
+    def address(self) -> str:
+        return self._lamp.address
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def start_notify(
+        self, char_specifier: str, callback: Callable[[int, bytearray], None]
+    ) -> None:
+        self._check_connected()
+        self._notify_callbacks[char_specifier] = callback
+
+    async def stop_notify(self, char_specifier: str) -> None:
+        self._notify_callbacks.pop(char_specifier, None)
+
+    async def write_gatt_char(
+        self, char_specifier: str, data: Any, response: bool = False
+    ) -> None:
+        self._check_connected()
+        lamp = self._lamp
+        await asyncio.sleep(lamp.delay())
+        self._check_connected()
+        random_ = lamp._simulator.random
+        if lamp.disconnect_rate and random_.random() < lamp.disconnect_rate:
+            self.drop()
+            raise BleakError(f"{lamp.address}: simulated disconnection")
+        if lamp.loss and random_.random() < lamp.loss:
+            lamp.stats["lost"] += 1
+            return
+        for notification in lamp.receive(bytes(data)):
+            self.notify(notification)
+
+    async def read_gatt_char(self, char_specifier: Any) -> bytearray:
+        raise BleakError("Reading characteristics is not simulated")
+
+    async def read_gatt_descriptor(self, handle: int) -> bytearray:
+        raise BleakError("Reading descriptors is not simulated")
+
+    def notify(self, notification: bytes) -> None:
+        """Send a notification to the subscribed callbacks, after the latency"""
+        lamp = self._lamp
+        if lamp.loss and lamp._simulator.random.random() < lamp.loss:
+            lamp.stats["lost"] += 1
+            return
+        loop = asyncio.get_running_loop()
+        for callback in self._notify_callbacks.values():
+            lamp.stats["notifications"] += 1
+            loop.call_later(lamp.delay(), self._deliver, callback, notification)
+
+    def _deliver(
+        self, callback: Callable[[int, bytearray], None], notification: bytes
+    ) -> None:
+        if self._connected:
+            callback(0, bytearray(notification))
+
+    async def disconnect(self) -> bool:
+        self.drop()
+        return True
+
+    def drop(self) -> None:
+        """Close the link and tell the owner of the client, as bleak does"""
+        if not self._connected:
+            return
+        self._connected = False
+        self._notify_callbacks.clear()
+        if self._lamp.client is self:
+            self._lamp.client = None
+        self._lamp.stats["disconnections"] += 1
+        if self._disconnected_callback is not None:
+            asyncio.get_running_loop().call_soon(self._disconnected_callback, self)
+
+    def _check_connected(self) -> None:
+        if not self._connected:
+            raise BleakError(f"{self._lamp.address}: not connected")
+
+
+class Simulator:
+    """A set of simulated lamps and the establish_connection reaching them"""
+
+    def __init__(self, seed: int | None = None) -> None:
+        self.random = random.Random(seed)
+        self._lamps: dict[str, SimulatedLamp] = {}
+
+    @property
+    def lamps(self) -> list[SimulatedLamp]:
+        return list(self._lamps.values())
+
+    def add_lamp(self, address: str | None = None, **options: Any) -> SimulatedLamp:
+        """Create a simulated lamp, see SimulatedLamp for the options"""
+        if address is None:
+            index = len(self._lamps) + 1
+            address = ":".join(
+                ["5E", "E1", "00"] + [f"{(index >> s) & 0xFF:02X}" for s in (16, 8, 0)]
+            )
+        lamp = SimulatedLamp(self, address, **options)
+        self._lamps[address] = lamp
+        return lamp
+
+    def lamp(self, address: str) -> SimulatedLamp:
+        return self._lamps[address]
+
+    async def establish_connection(
+        self,
+        client_class: type[BleakClient],
+        device: BLEDevice,
+        name: str,
+        disconnected_callback: Callable[[Any], None] | None = None,
+        max_attempts: int = 4,
+        **kwargs: Any,
+    ) -> BleakClient:
+        """Stand-in for bleak_retry_connector.establish_connection"""
+        lamp = self._lamps.get(device.address)
+        if lamp is None:
+            raise BleakError(f"{name}: unknown simulated device {device.address}")
+        for _ in range(max_attempts):
+            await asyncio.sleep(lamp.connect_latency)
+            if not lamp.in_range or self.random.random() < lamp.connect_failure:
+                lamp.stats["connect_failures"] += 1
+                continue
+            if lamp.client is not None:
+                lamp.client.drop()  # the lamp accepts a single connection
+            lamp.client = SimulatedClient(lamp, disconnected_callback)
+            lamp.stats["connects"] += 1
+            return cast(BleakClient, lamp.client)
+        raise BleakError(f"{name}: failed to connect after {max_attempts} attempts")
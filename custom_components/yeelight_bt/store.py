@@ -0,0 +1,61 @@
+""" persistence of the lamps identity and last state across restarts """
+from __future__ import annotations
+
+import logging
+from functools import partial
+from typing import Any, Callable
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .const import STORAGE_KEY, STORAGE_SAVE_DELAY, STORAGE_VERSION
+from .yeelightbt import Lamp
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class YeelightBTStore:
+    """Save the identity, pairing status and last state of all the lamps.
+    Saved data is restored into the lamps when they are added, so that their
+    first connection skips the identity queries (and the Candela pairing wait)
+    and their entities start with the last known state.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self._store: Store[dict[str, dict[str, Any]]] = Store(
+            hass, STORAGE_VERSION, STORAGE_KEY
+        )
+        self._data: dict[str, dict[str, Any]] = {}
+        self._lamps: dict[str, Lamp] = {}
+        self._callbacks: dict[str, Callable[[], None]] = {}
+
+    async def async_load(self) -> None:
+        self._data = await self._store.async_load() or {}
+
+    def add_lamp(self, lamp: Lamp) -> None:
+        if lamp.mac in self._data:
+            _LOGGER.debug(f"Restoring {lamp.mac}: {self._data[lamp.mac]}")
+            lamp.restore(self._data[lamp.mac])
+        self._lamps[lamp.mac] = lamp
+        self._callbacks[lamp.mac] = partial(self._lamp_updated, lamp)
+        lamp.add_callback_on_state_changed(self._callbacks[lamp.mac])
+
+    def remove_lamp(self, lamp: Lamp) -> None:
+        self._data[lamp.mac] = lamp.snapshot()
+        self._lamps.pop(lamp.mac, None)
+        lamp.remove_callback_on_state_changed(self._callbacks.pop(lamp.mac))
+        self._store.async_delay_save(self._data_to_save)
+
+    async def async_forget(self, mac: str) -> None:
+        """Drop the data of a lamp removed from HA"""
+        if self._data.pop(mac, None) is not None:
+            await self._store.async_save(self._data_to_save())
+
+    def _lamp_updated(self, lamp: Lamp) -> None:
+        # saved once after a burst of notifications (and when HA stops):
+        self._store.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+
+    def _data_to_save(self) -> dict[str, dict[str, Any]]:
+        for mac, lamp in self._lamps.items():
+            self._data[mac] = lamp.snapshot()
+        return self._data
@@ -0,0 +1,99 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Bounded trace of the frames exchanged with a lamp.
+Each frame written to the lamp and each notification it sends is recorded with
+its monotonic time and direction, as a fixed size binary record, in a ring
+buffer keeping the last records only. Recording formats nothing, so the trace
+is always on without changing the timings it captures.
+"""
+from __future__ import annotations
+
+# Standard imports
+import struct
+import time
+from typing import Iterator, NamedTuple
+
+from .codec import FRAME_SIZE, Buffer
+
+TRACE_RECORDS = 256  # records kept per lamp
+
+DIRECTION_OUT = 0  # frame written to the lamp
+DIRECTION_IN = 1  # notification received from the lamp
+
+# A record is the monotonic time (s), the direction and the length of the
+# frame, followed by the frame (truncated or zero padded to FRAME_SIZE):
+_HEADER = struct.Struct("<dBB")
+_pack_header = _HEADER.pack_into
+RECORD_SIZE = _HEADER.size + FRAME_SIZE
+
+_PADDING = bytes(FRAME_SIZE)
+
+
+class TraceRecord(NamedTuple):
+    time: float
+    direction: int
+    frame: bytes
+
+
+class FrameTrace:
+    """Ring buffer of the last frames exchanged with a lamp"""
+
+    __slots__ = ("_buffer", "_capacity", "_next", "recorded")
+
+    def __init__(self, capacity: int = TRACE_RECORDS) -> None:
+        self._buffer = bytearray(capacity * RECORD_SIZE)
+        self._capacity = capacity
+        self._next = 0  # index of the record to overwrite next
+        self.recorded = 0  # records since the start, including overwritten ones
+
+    def record(self, direction: int, frame: Buffer) -> None:
+        offset = self._next * RECORD_SIZE
+        length = len(frame)
+        if length > FRAME_SIZE:
+            length = FRAME_SIZE
+        _pack_header(self._buffer, offset, time.monotonic(), direction, length)
+        start = offset + _HEADER.size
+        self._buffer[start : start + length] = frame[:length]
+        if length < FRAME_SIZE:
+            self._buffer[start + length : start + FRAME_SIZE] = _PADDING[length:]
+        self._next += 1
+        if self._next == self._capacity:
+            self._next = 0
+        self.recorded += 1
+
+    def __len__(self) -> int:
+        return min(self.recorded, self._capacity)
+
+    def dump(self) -> bytes:
+        """Return the records kept, oldest first, in their binary form"""
+        if self.recorded < self._capacity:
+            return bytes(self._buffer[: self._next * RECORD_SIZE])
+        split = self._next * RECORD_SIZE
+        return bytes(self._buffer[split:] + self._buffer[:split])
+
+    def records(self) -> list[TraceRecord]:
+        return list(iter_records(self.dump()))
+
+
+def iter_records(data: Buffer) -> Iterator[TraceRecord]:
+    """Decode the records of a binary trace (as returned by FrameTrace.dump)"""
+    view = memoryview(data)
+    for offset in range(0, len(view) - RECORD_SIZE + 1, RECORD_SIZE):
+        timestamp, direction, length = _HEADER.unpack_from(view, offset)
+        start = offset + _HEADER.size
+        yield TraceRecord(timestamp, direction, bytes(view[start : start + length]))
+
+
+def format_records(records: list[TraceRecord]) -> list[str]:
+    """One line per record: seconds since the first record, direction, frame"""
+    if not records:
+        return []
+    first = records[0].time
+    return [
+        f"{record.time - first:10.3f} {'>' if record.direction == DIRECTION_OUT else '<'}"
+        f" {record.frame.hex()}"
+        for record in records
+    ]
@@ -0,0 +1,135 @@
+"""
+Creator : hcoohb
+License : MIT
+Source  : https://github.com/hcoohb/hass-yeelightbt
+
+Long transitions of the lamps settings.
+The lamps fade by themselves to a new setting in under a second only, longer
+transitions are streamed to them as a series of intermediate settings (frames).
+"""
+from __future__ import annotations
+
+# Standard imports
+import asyncio
+import logging
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from .yeelightbt import Lamp
+
+# Frames are spaced by this many times the time the lamp takes to accept one,
+# within these bounds (seconds):
+LATENCY_FACTOR = 3.0
+MIN_FRAME_INTERVAL = 0.25
+MAX_FRAME_INTERVAL = 2.0
+# Lowest brightness of a fade out before the lamp is turned off:
+MIN_BRIGHTNESS = 1
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class TransitionTarget(NamedTuple):
+    """Settings to reach at the end of a transition (None: unchanged)"""
+
+    brightness: int | None = None
+    rgb: tuple[int, int, int] | None = None
+    temperature: int | None = None
+    turn_off: bool = False
+
+
+class Frame(NamedTuple):
+    """Intermediate settings written to the lamp"""
+
+    brightness: int
+    rgb: tuple[int, int, int] | None
+    temperature: int | None
+
+
+def _lerp(start: int, end: int, progress: float) -> int:
+    return round(start + (end - start) * progress)
+
+
+def frame_at(start: Frame, end: Frame, progress: float) -> Frame:
+    """Return the settings at a given progress [0-1] of a transition"""
+    rgb = end.rgb
+    if rgb is not None and start.rgb is not None:
+        rgb = (
+            _lerp(start.rgb[0], rgb[0], progress),
+            _lerp(start.rgb[1], rgb[1], progress),
+            _lerp(start.rgb[2], rgb[2], progress),
+        )
+    temperature = end.temperature
+    if temperature is not None and start.temperature is not None:
+        temperature = _lerp(start.temperature, temperature, progress)
+    brightness = _lerp(start.brightness, end.brightness, progress)
+    return Frame(brightness, rgb, temperature)
+
+
+def frame_interval(latency: float) -> float:
+    """Return the time between two frames for a given write latency"""
+    return min(MAX_FRAME_INTERVAL, max(MIN_FRAME_INTERVAL, LATENCY_FACTOR * latency))
+
+
+async def _write_frame(lamp: Lamp, frame: Frame) -> None:
+    if frame.rgb is not None:
+        await lamp.set_color(*frame.rgb, brightness=frame.brightness)
+    elif frame.temperature is not None:
+        await lamp.set_temperature(frame.temperature, brightness=frame.brightness)
+    else:
+        await lamp.set_brightness(frame.brightness)
+
+
+async def run_transition(lamp: Lamp, target: TransitionTarget, duration: float) -> int:
+    """Stream the frames of a transition to the lamp.
+    The frame rate follows the time the lamp takes to accept a frame, so a slow
+    link gets fewer frames instead of a longer transition.
+    Returns the number of frames written.
+    """
+    loop = asyncio.get_running_loop()
+    if not lamp.is_on:
+        if target.turn_off:
+            return 0
+        # settings cannot be written while off: fade in from the lowest brightness
+        await lamp.turn_on()
+        start_brightness = MIN_BRIGHTNESS
+    else:
+        start_brightness = lamp.brightness
+    end_brightness = target.brightness
+    if target.turn_off:
+        end_brightness = MIN_BRIGHTNESS
+    elif end_brightness is None:
+        end_brightness = lamp.brightness
+    # colour and temperature only blend within the current mode of the lamp:
+    start = Frame(
+        start_brightness,
+        lamp.color if lamp.mode == lamp.MODE_COLOR else None,
+        lamp.temperature if lamp.mode == lamp.MODE_WHITE else None,
+    )
+    end = Frame(end_brightness, target.rgb, target.temperature)
+
+    begin = loop.time()
+    finish = begin + max(0.0, duration)
+    latency = 0.0
+    last: Frame | None = None
+    frames = 0
+    while True:
+        now = loop.time()
+        progress = 1.0 if now >= finish else (now - begin) / (finish - begin)
+        frame = frame_at(start, end, progress)
+        if frame != last:
+            await _write_frame(lamp, frame)
+            frames += 1
+            last = frame
+            spent = loop.time() - now
+            latency = spent if frames == 1 else 0.7 * latency + 0.3 * spent
+        if progress >= 1.0:
+            break
+        next_frame = min(now + frame_interval(latency), finish)
+        await asyncio.sleep(max(0.0, next_frame - loop.time()))
+    if target.turn_off:
+        await lamp.turn_off()
+    _LOGGER.debug(
+        f"{lamp.mac}: transition of {duration}s done in {frames} frames, "
+        f"write latency {latency:.3f}s"
+    )
+    return frames
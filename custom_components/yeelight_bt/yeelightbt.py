@@ -9,8 +9,10 @@ from __future__ import annotations
 import asyncio
 import enum
 import logging
-import struct
-from typing import Any, Callable, cast
+import math
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Coroutine, NamedTuple, cast
 
 # 3rd party imports
 from bleak import BleakClient, BleakError, BleakScanner
@@ -18,36 +20,108 @@ from bleak.backends.client import BaseBleakClient
 from bleak.backends.device import BLEDevice
 from bleak_retry_connector import establish_connection
 
+# the protocol constants are re-exported from here for compatibility:
+from .codec import (  # noqa: F401
+    CANDELA_DECODERS,
+    CMD_BRIGHTNESS,
+    CMD_COLOR,
+    CMD_GETNAME,
+    CMD_GETSERIAL,
+    CMD_GETSTATE,
+    CMD_GETSTATE_SEC,
+    CMD_GETVER,
+    CMD_PAIR,
+    CMD_PAIR_ON,
+    CMD_POWER,
+    CMD_POWER_OFF,
+    CMD_POWER_ON,
+    CMD_RGB,
+    CMD_TEMP,
+    COMMAND_STX,
+    DECODERS,
+    FRAME_GETNAME,
+    FRAME_GETSERIAL,
+    FRAME_GETSTATE,
+    FRAME_GETVER,
+    FRAME_PAIR,
+    FRAME_POWER_OFF,
+    FRAME_POWER_ON,
+    RES_GETNAME,
+    RES_GETSERIAL,
+    RES_GETSTATE,
+    RES_GETTIME,
+    RES_GETVER,
+    RES_PAIR,
+    CandelaStateResult,
+    NameResult,
+    PairResult,
+    SerialResult,
+    StateResult,
+    VersionResult,
+    decode_notification,
+    encode_brightness,
+    encode_color,
+    encode_temperature,
+)
+from .connection import (
+    BreakerState,
+    CircuitBreaker,
+    ConnectionManager,
+    LampUnreachableError,
+    get_connection_manager,
+    is_bluez_client,
+)
+from .metrics import (
+    DISCONNECT_CLOSED,
+    DISCONNECT_EVICTED,
+    DISCONNECT_IDLE,
+    DISCONNECT_LOST,
+    DISCONNECT_RECONNECT,
+    DISCONNECT_REQUESTED,
+    LampMetrics,
+)
+from .presence import Presence
+from .trace import DIRECTION_IN, DIRECTION_OUT, FrameTrace
+from .transition import TransitionTarget, run_transition
+
 NOTIFY_UUID = "8f65073d-9f57-4aaa-afea-397d19d5bbeb"
 CONTROL_UUID = "aa7d3f34-2d4f-41e0-807f-52fbf8cf7443"
 
-COMMAND_STX = 0x43
-CMD_PAIR = 0x67
-CMD_PAIR_ON = 0x02
-RES_PAIR = 0x63
-CMD_POWER = 0x40
-CMD_POWER_ON = 0x01
-CMD_POWER_OFF = 0x02
-CMD_COLOR = 0x41
-CMD_BRIGHTNESS = 0x42
-CMD_TEMP = 0x43
-CMD_RGB = 0x41
-CMD_GETSTATE = 0x44
-CMD_GETSTATE_SEC = 0x02
-RES_GETSTATE = 0x45
-CMD_GETNAME = 0x52
-RES_GETNAME = 0x53
-CMD_GETVER = 0x5C
-RES_GETVER = 0x5D
-CMD_GETSERIAL = 0x5E
-RES_GETSERIAL = 0x5F
-RES_GETTIME = 0x62
+# Time to wait for the notification answering a command:
+RESPONSE_TIMEOUT = 2.0
+# Time to wait for the user to push the pairing button:
+PAIRING_TIMEOUT = 60.0
+# Initial delay after commands that get no notification back,
+# refined with the measured response latency of the lamp:
+FALLBACK_DELAY = 0.1
+# Time for the lamp to finish transitioning to a new brightness/color/temperature:
+TRANSITION_SETTLE = 0.7
+# Connection policies timings:
+DEFAULT_IDLE_TIMEOUT = 30.0
+KEEPALIVE_INTERVAL = 60.0
+RECONNECT_DELAY = 5.0
 
 MODEL_BEDSIDE = "Bedside"
 MODEL_CANDELA = "Candela"
 MODEL_UNKNOWN = "Unknown"
 
 
+# Commands for which only the latest value matters (latest-wins coalescing):
+COALESCED_CMDS = (CMD_BRIGHTNESS, CMD_COLOR, CMD_TEMP)
+
+# Signature of bleak_retry_connector.establish_connection, which can be
+# replaced (e.g. by the simulator) when creating a Lamp:
+Connector = Callable[..., Awaitable[BleakClient]]
+
+
+class Priority(enum.IntEnum):
+    """Order in which queued frames are written, lowest value first"""
+
+    USER = 0  # commands of the user
+    RECONCILE = 1  # reads checking the lamp followed recent commands
+    POLL = 2  # routine state refreshes
+
+
 class Conn(enum.Enum):
     DISCONNECTED = 1
     UNPAIRED = 2
@@ -55,11 +129,51 @@ class Conn(enum.Enum):
     PAIRED = 4
 
 
+class ConnectionPolicy(enum.Enum):
+    """How long a lamp stays connected once a command has been sent"""
+
+    ALWAYS = "always"  # stay connected, keepalive and reconnect when dropped
+    IDLE = "idle"  # disconnect after being idle for idle_timeout seconds
+    ON_DEMAND = "on_demand"  # disconnect as soon as the commands are sent
+
+
+class LampState(NamedTuple):
+    """Snapshot of the decoded state of a lamp"""
+
+    is_on: bool
+    mode: int | None
+    brightness: int
+    rgb: tuple[int, int, int]
+    temperature: int
+
+
 _LOGGER = logging.getLogger(__name__)
 
 
-def model_from_name(ble_name: str) -> str:
+class _PendingCmd:
+    """A frame waiting in the outgoing queue of a lamp"""
+
+    __slots__ = ("bits", "response", "key", "future", "priority")
+
+    def __init__(
+        self,
+        bits: bytes | memoryview,
+        response: int | None,
+        key: int | None,
+        future: asyncio.Future[bool],
+        priority: Priority = Priority.USER,
+    ) -> None:
+        self.bits = bits
+        self.response = response
+        self.key = key
+        self.future = future
+        self.priority = priority
+
+
+def model_from_name(ble_name: str | None) -> str:
     model = MODEL_UNKNOWN
+    if not ble_name:
+        return model  # not advertised yet, the model may be restored
     if ble_name.startswith("XMCTD_"):
         model = MODEL_BEDSIDE
     if ble_name.startswith("yeelight_ms"):
@@ -76,8 +190,16 @@ class Lamp:
     MODE_WHITE = 0x02
     MODE_FLOW = 0x03
 
-    def __init__(self, ble_device: BLEDevice):
+    def __init__(
+        self,
+        ble_device: BLEDevice,
+        connection_manager: ConnectionManager | None = None,
+        policy: ConnectionPolicy = ConnectionPolicy.ALWAYS,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        connector: Connector = establish_connection,
+    ):
         self._client: BleakClient | None = None
+        self._connector = connector
         self._ble_device = ble_device
         self._mac = self._ble_device.address
         _LOGGER.debug(
@@ -88,17 +210,81 @@ class Lamp:
         self._rgb = (0, 0, 0)
         self._brightness = 0
         self._temperature = 0
-        self.versions: str | None = None
-        self._model = model_from_name(self._ble_device.name)
+        self._state_time: float | None = None  # monotonic time of last state notif
+        # last state notified (or restored), kept while disconnected:
+        self._last_state: LampState | None = None
+        self.versions: VersionResult | None = None
+        self.serial: int | None = None
+        self.name: str | None = None
+        # the lamp accepted the pairing of this host at least once:
+        self.paired = False
+        # notification handlers per response type:
+        self._handlers: dict[int, Callable[[Any], Any]] = {
+            RES_GETSTATE: self._on_state,
+            RES_PAIR: self._on_pair,
+            RES_GETVER: self._on_version,
+            RES_GETSERIAL: self._on_serial,
+            RES_GETNAME: self._on_name,
+        }
+        self._set_model(model_from_name(self._ble_device.name))
         self._mode: int | None = (
             self.MODE_WHITE if self._model == MODEL_CANDELA else None
         )
         # store func to call on state received:
         self._state_callbacks: list[Callable[[], None]] = []
         self._conn = Conn.DISCONNECTED
-        self._pair_resp_event = asyncio.Event()
+        # disconnected on purpose to free the adapter, still available:
+        self._parked = False
+        self._connection_manager = connection_manager or get_connection_manager()
+        self._policy = policy
+        self._idle_timeout = idle_timeout
+        # seconds without news before the keepalive of an always connected lamp:
+        self._keepalive_interval = KEEPALIVE_INTERVAL
+        self._policy_timer: asyncio.TimerHandle | None = None
+        self._policy_task: asyncio.Task[Any] | None = None
+        self._closed = False
+        # connections paid per policy (count and seconds spent connecting):
+        self._connect_stats: dict[str, dict[str, float]] = {}
+        # futures resolved by the next notification of a given response type:
+        self._pending_responses: dict[int, asyncio.Future[Any]] = {}
+        self._ack_latency = FALLBACK_DELAY
+        self._settle_deadline = 0.0
+        # background task streaming a long transition or an effect:
+        self._animation: asyncio.Task[int] | None = None
+        self._animation_name: str | None = None
         self._read_service = False
         self._is_client_bluez = True
+        # outgoing command queue, drained by whoever holds the send lock:
+        self._cmd_queue: deque[_PendingCmd] = deque()
+        self._send_lock = asyncio.Lock()
+        # connection attempt shared by all the callers of connect:
+        self._connect_task: asyncio.Task[None] | None = None
+        self._queue_changed = asyncio.Event()
+        self._cmd_stats = {
+            "queued": 0,
+            "written": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "failed": 0,
+        }
+        self.metrics = LampMetrics()
+        # last frames written to and notified by the lamp:
+        self.trace = FrameTrace()
+        # whether the lamp advertises, to avoid connecting when out of range:
+        self.presence = Presence()
+        # stops the connection attempts while the lamp keeps failing to connect:
+        self.breaker = CircuitBreaker()
+        # set while disconnecting on purpose, to tell a lost connection apart:
+        self._disconnecting = False
+
+    def _set_model(self, model: str) -> None:
+        """Select the notification decoders of the lamp model"""
+        self._model = model
+        self._decoders = DECODERS
+        self._handlers[RES_GETSTATE] = self._on_state
+        if model == MODEL_CANDELA:
+            self._decoders = CANDELA_DECODERS
+            self._handlers[RES_GETSTATE] = self._on_candela_state
 
     def __str__(self) -> str:
         """The string representation"""
@@ -130,6 +316,10 @@ class Lamp:
         """
         self._state_callbacks.append(func)
 
+    def remove_callback_on_state_changed(self, func: Callable[[], None]) -> None:
+        """Unregister a callback registered with add_callback_on_state_changed"""
+        self._state_callbacks.remove(func)
+
     def run_state_changed_cb(self) -> None:
         """Execute all registered callbacks for a state change"""
         for func in self._state_callbacks:
@@ -140,38 +330,83 @@ class Lamp:
         # ensure we are responding to the newest client:
         # if client != self._client:
         #     return
-        self._mode = None  # lamp not available
+        if not self._disconnecting and self._conn != Conn.DISCONNECTED:
+            self.metrics.disconnects[DISCONNECT_LOST] += 1
         self._conn = Conn.DISCONNECTED
+        self._connection_manager.release(self)
+        if self._parked:
+            return
+        self._mode = None  # lamp not available
         self.run_state_changed_cb()
+        if self._policy == ConnectionPolicy.ALWAYS:
+            self._schedule_policy(RECONNECT_DELAY)
 
     async def connect(self, num_tries: int = 3) -> None:
+        """Connect and pair the lamp, unless it already is.
+        Connecting is single-flight: concurrent callers wait for the attempt in
+        progress (and share its outcome) instead of each disconnecting the
+        others to start its own.
+        """
+        task = self._connect_task
+        if task is None or task.done():
+            if (
+                self._conn == Conn.PAIRED
+                and self._client is not None
+                and self._client.is_connected
+            ):
+                return
+            task = self._connect_task = asyncio.create_task(self._connect())
+        # a cancelled caller does not cancel the attempt of the others:
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # an attempt cancelled by close() just leaves the lamp disconnected
+            if not (task.cancelled() and self._closed):
+                raise
+
+    def _is_closed(self) -> bool:
+        # a method, as close() may run while connecting
+        return self._closed
+
+    async def _connect(self) -> None:
+        if self._is_closed():
+            return
         if (
             self._client and not self._client.is_connected
         ):  # check the connection has not dropped
-            await self.disconnect()
+            await self.disconnect(DISCONNECT_RECONNECT)
         if self._conn == Conn.PAIRING or self._conn == Conn.PAIRED:
             # We do not try to reconnect if we are disconnected or unpaired
             return
+        if not self.reachable:
+            _LOGGER.debug(f"{self._mac} is not reachable, not connecting")
+            return
+        # once the breaker delay is over, a single attempt probes the lamp:
+        probe = self.breaker.state == BreakerState.HALF_OPEN
         _LOGGER.debug("Initiating new connection")
+        start = asyncio.get_running_loop().time()
+        self.metrics.connect_attempts += 1
         try:
             if self._client:
-                await self.disconnect()
+                await self.disconnect(DISCONNECT_RECONNECT)
 
+            await self._connection_manager.acquire(self)
             _LOGGER.debug(f"Connecting now to {self._ble_device}:...")
-            self._client = await establish_connection(
+            self._client = await self._connector(
                 BleakClient,
                 device=self._ble_device,
                 name=self._mac,
                 disconnected_callback=self.diconnected_cb,
-                max_attempts=4,
+                max_attempts=1 if probe else 4,
             )
+            if self._is_closed():
+                # the lamp was closed while the connection was established:
+                await self.disconnect(DISCONNECT_CLOSED)
+                return
             _LOGGER.debug(
                 f"Client used is: {self._client}. Backend is {self._client._backend}"
             )
-            self._is_client_bluez = (
-                str(type(self._client._backend))
-                == "<class 'bleak.backends.bluezdbus.client.BleakClientBlueZDBus'>"
-            )
+            self._is_client_bluez = is_bluez_client(self._client)
             self._conn = Conn.UNPAIRED
             _LOGGER.debug(f"Connected: {self._client.is_connected}")
 
@@ -179,16 +414,17 @@ class Lamp:
             if not self._read_service and _LOGGER.isEnabledFor(logging.DEBUG):
                 await self.read_services()
                 self._read_service = True
-                await asyncio.sleep(0.2)
 
             if self._model == MODEL_BEDSIDE:
                 _LOGGER.debug("Request Notify")
                 await self._client.start_notify(NOTIFY_UUID, self.notification_handler)
-                await asyncio.sleep(0.3)
                 _LOGGER.debug("Request Pairing")
+                pairing = asyncio.get_running_loop().time()
                 await self.pair()
-                await asyncio.sleep(0.3)
                 if self._conn == Conn.PAIRED:
+                    self.metrics.pairing_time.observe(
+                        asyncio.get_running_loop().time() - pairing
+                    )
                     # ensure we get state straight away after connection
                     await self.get_state()
                     if not self.versions:
@@ -199,12 +435,17 @@ class Lamp:
                 # It may be that on bluez the notification request is not sent properly
                 # Not sure on esp... so only applyt to bluez
                 _LOGGER.debug("Request Pairing")
+                pairing = asyncio.get_running_loop().time()
                 await self.pair()
                 # since we have no feedback
                 # we wait longer on first connection in case need to push button...
-                await asyncio.sleep(0.3 if self.versions else 10)
+                await asyncio.sleep(self._ack_latency if self.paired else 10)
                 # now we are assuming that we paired successfully
                 self._conn = Conn.PAIRED
+                self.paired = True
+                self.metrics.pairing_time.observe(
+                    asyncio.get_running_loop().time() - pairing
+                )
                 # ensure we get state straight away after connection
                 await self.get_state()
                 if not self.versions:
@@ -214,50 +455,270 @@ class Lamp:
                 self.run_state_changed_cb()
 
             _LOGGER.debug(f"Connection status: {self._conn}")
+            self._parked = False
+            self.presence.seen()
+            self.breaker.success()
+            duration = asyncio.get_running_loop().time() - start
+            self._record_connect(duration)
+            if self._conn == Conn.PAIRED:
+                self.metrics.connect_time.observe(duration)
+            else:
+                self.metrics.connect_failures += 1
 
         except asyncio.TimeoutError:
             _LOGGER.error("Connection Timeout error")
+            self._connection_failed()
         except BleakError as err:
             _LOGGER.error(f"Connection: BleakError: {err}")
+            self._connection_failed()
+
+    def _connection_failed(self) -> None:
+        self.metrics.connect_failures += 1
+        self.breaker.failure()
+        if self.breaker.state == BreakerState.OPEN:
+            _LOGGER.warning(
+                f"{self._mac} is unreachable, "
+                f"next attempt in {self.breaker.retry_in:.0f}s"
+            )
+        if self._client is None or not self._client.is_connected:
+            self._connection_manager.release(self)
+        if self._parked:
+            # the lamp was assumed available while parked, it is not anymore
+            self._parked = False
+            self._mode = None
+            self.run_state_changed_cb()
 
     async def pair(self) -> None:
         """Send pairing command directly"""
-        bits = bytearray(struct.pack("BBB15x", COMMAND_STX, CMD_PAIR, CMD_PAIR_ON))
         if self._conn != Conn.UNPAIRED or self._client is None:
             _LOGGER.error("Pairing: Cannot request pair as not connected")
             return
         try:
+            self.trace.record(DIRECTION_OUT, FRAME_PAIR)
             if self._model == MODEL_CANDELA and self._is_client_bluez:
-                await self._client.write_gatt_char(CONTROL_UUID, bits)
+                await self._client.write_gatt_char(CONTROL_UUID, FRAME_PAIR)
                 return
-            self._pair_resp_event.clear()
-            await self._client.write_gatt_char(CONTROL_UUID, bits)
+            answer = self._expect(RES_PAIR)
+            await self._client.write_gatt_char(CONTROL_UUID, FRAME_PAIR)
             # wait after pairing to receive notif of pair result:
-            await self._pair_resp_event.wait()
+            if not await self._wait_answer(answer, RESPONSE_TIMEOUT):
+                _LOGGER.error("Pairing: No answer from the lamp")
+                self._resolve(RES_PAIR, None)
+            # the lamp may wait for its button to be pushed:
+            while cast(Conn, self._conn) == Conn.PAIRING:
+                answer = self._expect(RES_PAIR)
+                if not await self._wait_answer(answer, PAIRING_TIMEOUT):
+                    self._resolve(RES_PAIR, None)
+                    _LOGGER.error("Pairing: The lamp button was not pushed in time")
+                    self._conn = Conn.UNPAIRED
         except asyncio.TimeoutError:
             _LOGGER.error("Pairing: Timeout error")
         except BleakError as err:
             _LOGGER.error(f"Pairing: BleakError: {err}")
 
-    async def disconnect(self) -> None:
+    async def disconnect(self, reason: str = DISCONNECT_REQUESTED) -> None:
         if self._client is None:
             return
+        if self._client.is_connected:
+            self.metrics.disconnects[reason] += 1
+            # still in range, though it does not advertise while connected:
+            self.presence.seen()
+        self._disconnecting = True
         try:
             await self._client.disconnect()
         except asyncio.TimeoutError:
             _LOGGER.error("Disconnection: Timeout error")
         except BleakError as err:
             _LOGGER.error(f"Disconnection: BleakError: {err}")
+        finally:
+            self._disconnecting = False
         self._conn = Conn.DISCONNECTED
+        self._connection_manager.release(self)
+
+    def _record_connect(self, duration: float) -> None:
+        stats = self._connect_stats.setdefault(
+            self._policy.value, {"connects": 0, "connect_time": 0.0}
+        )
+        stats["connects"] += 1
+        stats["connect_time"] += duration
+
+    @property
+    def connection_stats(self) -> dict[str, dict[str, float]]:
+        """Connections paid per connection policy (count and total seconds)"""
+        return {policy: dict(stats) for policy, stats in self._connect_stats.items()}
+
+    @property
+    def connection_policy(self) -> ConnectionPolicy:
+        return self._policy
+
+    def set_connection_policy(
+        self, policy: ConnectionPolicy, idle_timeout: float = DEFAULT_IDLE_TIMEOUT
+    ) -> None:
+        """Change how long the lamp stays connected after sending commands"""
+        _LOGGER.debug(f"Connection policy of {self._mac}: {policy}, {idle_timeout}s")
+        self._policy = policy
+        self._idle_timeout = idle_timeout
+        self._schedule_policy(self._policy_delay())
+
+    @property
+    def keepalive_interval(self) -> float:
+        return self._keepalive_interval
+
+    def set_keepalive_interval(self, interval: float) -> None:
+        """Change how long an always connected lamp may stay without news
+        before the keepalive reads its state. Set to the refresh interval of
+        the lamp, so that the keepalive does not poll it more often.
+        """
+        self._keepalive_interval = interval
+
+    def _policy_delay(self) -> float:
+        if self._policy == ConnectionPolicy.ALWAYS:
+            return self._keepalive_interval
+        if self._policy == ConnectionPolicy.IDLE:
+            return self._idle_timeout
+        return 0
+
+    def _schedule_policy(self, delay: float) -> None:
+        """(Re)start the timer applying the connection policy once idle"""
+        if self._policy_timer is not None:
+            self._policy_timer.cancel()
+        if self._closed:
+            return
+        self._policy_timer = asyncio.get_running_loop().call_later(
+            delay, self._apply_policy
+        )
+
+    def _apply_policy(self) -> None:
+        self._policy_timer = None
+        if not self.idle or (self._policy_task and not self._policy_task.done()):
+            return  # the end of the current activity reschedules the timer
+        if self._policy == ConnectionPolicy.ALWAYS:
+            if self._parked:
+                return  # evicted to free the adapter, do not fight for a slot
+            if self.connected and self.state_age < self._keepalive_interval:
+                # the state was read or notified since, the link is alive:
+                self._schedule_policy(self._keepalive_interval - self.state_age)
+                return
+            # keepalive, which also reconnects if the connection dropped:
+            self._policy_task = asyncio.create_task(self.get_state(Priority.POLL))
+        elif self._conn != Conn.DISCONNECTED:
+            self._policy_task = asyncio.create_task(self.park(DISCONNECT_IDLE))
+
+    async def close(self) -> None:
+        """Stop applying the connection policy and disconnect for good"""
+        self._closed = True
+        if self._policy_timer is not None:
+            self._policy_timer.cancel()
+            self._policy_timer = None
+        if self._policy_task is not None:
+            self._policy_task.cancel()
+        self.stop_animation()
+        task = self._connect_task
+        if task is not None and not task.done():
+            # a connection still in progress must not outlive the lamp:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.disconnect(DISCONNECT_CLOSED)
+        self._connection_manager.release(self)
+
+    async def park(self, reason: str = DISCONNECT_EVICTED) -> None:
+        """Disconnect to free the adapter connection slot.
+        The lamp stays available and reconnects on the next command.
+        """
+        self._parked = self._conn == Conn.PAIRED
+        await self.disconnect(reason)
 
     @property
     def mac(self) -> str:
         return self._mac
 
+    @property
+    def ble_device(self) -> BLEDevice:
+        return self._ble_device
+
+    def set_ble_device(self, ble_device: BLEDevice) -> None:
+        """Connect through the device of the latest advertisement of the lamp"""
+        self._ble_device = ble_device
+        if self._model == MODEL_UNKNOWN:
+            self._set_model(model_from_name(ble_device.name))
+
     @property
     def available(self) -> bool:
+        if self._conn == Conn.PAIRED:
+            return True
+        # parked: assumed available while it is in range
+        return self._parked and self._conn == Conn.DISCONNECTED and self.in_range
+
+    @property
+    def connected(self) -> bool:
+        """True if the lamp is connected and paired, ready for commands"""
         return self._conn == Conn.PAIRED
 
+    @property
+    def in_range(self) -> bool:
+        """True if the lamp is connected, or advertised recently"""
+        return self._conn != Conn.DISCONNECTED or self.presence.present
+
+    @property
+    def reachable(self) -> bool:
+        """False if a connection would not be attempted right now"""
+        if self._conn != Conn.DISCONNECTED:
+            return True
+        return self.presence.present and self.breaker.state != BreakerState.OPEN
+
+    def _check_reachable(self) -> None:
+        """Fail fast instead of queueing a command that cannot be sent"""
+        if self.reachable:
+            return
+        if not self.in_range:
+            raise LampUnreachableError(
+                f"Lamp {self._mac} is out of range (not advertising)"
+            )
+        raise LampUnreachableError(
+            f"Lamp {self._mac} failed to connect, "
+            f"next attempt in {self.breaker.retry_in:.0f}s"
+        )
+
+    def advertised(self, ble_device: BLEDevice, rssi: int | None = None) -> bool:
+        """The lamp was seen advertising. Returns True if it was out of range"""
+        self.set_ble_device(ble_device)
+        was_in_range = self.in_range
+        self.presence.seen(rssi)
+        if was_in_range:
+            return False
+        _LOGGER.debug(f"{self._mac} is in range")
+        # back in range (e.g. plugged back in): no need to wait for the breaker
+        self.breaker.close()
+        self.run_state_changed_cb()
+        return True
+
+    def out_of_range(self) -> None:
+        """The lamp stopped advertising"""
+        self.presence.lost()
+        if self._conn == Conn.DISCONNECTED:
+            _LOGGER.debug(f"{self._mac} is out of range")
+            self.run_state_changed_cb()
+
+    @property
+    def idle(self) -> bool:
+        """True when connected but with no command being sent"""
+        return (
+            not self._send_lock.locked() and not self._cmd_queue and not self.animating
+        )
+
+    @property
+    def animating(self) -> bool:
+        """True while a long transition or an effect is streamed to the lamp"""
+        return self._animation is not None and not self._animation.done()
+
+    @property
+    def effect(self) -> str | None:
+        """Name of the effect being played, if any"""
+        return self._animation_name if self.animating else None
+
     @property
     def model(self) -> str:
         return self._model
@@ -282,6 +743,83 @@ class Lamp:
     def color(self) -> tuple[int, int, int]:
         return self._rgb
 
+    @property
+    def command_stats(self) -> dict[str, int]:
+        """Counters of frames queued, written, coalesced, dropped and failed.
+        Coalesced frames were replaced by a newer one of the same kind, dropped
+        ones were background reads made useless by a user command.
+        """
+        return dict(self._cmd_stats)
+
+    def diagnostics(self) -> dict[str, Any]:
+        """Identity, connection and performance metrics of the lamp"""
+        return {
+            "model": self._model,
+            "versions": self.versions,
+            "serial": self.serial,
+            "connection": self._conn.name,
+            "connection_policy": self._policy.value,
+            "keepalive_interval": self._keepalive_interval,
+            "parked": self._parked,
+            "breaker": self.breaker.as_dict(),
+            "presence": {
+                "tracking": self.presence.tracking,
+                "in_range": self.in_range,
+                "last_seen_age": self.presence.age,
+                "rssi": self.presence.rssi,
+            },
+            "state": self.state._asdict(),
+            "state_age": None if math.isinf(self.state_age) else self.state_age,
+            "ack_latency": self._ack_latency,
+            "commands": self.command_stats,
+            "connections": self.connection_stats,
+            **self.metrics.as_dict(),
+        }
+
+    def snapshot(self) -> dict[str, Any]:
+        """Identity, pairing status and last known state, to be persisted"""
+        state = self._last_state
+        return {
+            "model": self._model,
+            "versions": list(self.versions) if self.versions else None,
+            "serial": self.serial,
+            "name": self.name,
+            "paired": self.paired,
+            "state": None if state is None else state._asdict(),
+        }
+
+    def restore(self, snapshot: dict[str, Any]) -> None:
+        """Restore a snapshot taken before a restart, before connecting.
+        Known identity and pairing skip their queries and waits on connection.
+        A restored state is assumed until the first connection, as if parked.
+        """
+        try:
+            if self._model == MODEL_UNKNOWN and snapshot.get("model"):
+                self._set_model(snapshot["model"])
+            if snapshot.get("versions") and self.versions is None:
+                self.versions = VersionResult(*snapshot["versions"])
+            self.serial = self.serial or snapshot.get("serial")
+            self.name = self.name or snapshot.get("name")
+            self.paired = self.paired or bool(snapshot.get("paired"))
+            saved = snapshot.get("state")
+            if saved and self._last_state is None and self._conn == Conn.DISCONNECTED:
+                state = LampState(
+                    bool(saved["is_on"]),
+                    saved["mode"],
+                    int(saved["brightness"]),
+                    cast("tuple[int, int, int]", tuple(saved["rgb"])),
+                    int(saved["temperature"]),
+                )
+                self._last_state = state
+                self._is_on = state.is_on
+                self._mode = state.mode
+                self._brightness = state.brightness
+                self._rgb = state.rgb
+                self._temperature = state.temperature
+                self._parked = self.paired
+        except (KeyError, TypeError, ValueError) as err:
+            _LOGGER.warning(f"Ignoring invalid saved data of {self._mac}: {err}")
+
     def get_prop_min_max(self) -> dict[str, Any]:
         return {
             "brightness": {"min": 0, "max": 100},
@@ -289,36 +827,319 @@ class Lamp:
             "color": {"min": 0, "max": 255},
         }
 
-    async def send_cmd(self, bits: bytes, wait_notif: float = 0.5) -> bool:
-        await self.connect()
-        if self._conn == Conn.PAIRED and self._client is not None:
+    @property
+    def settling(self) -> bool:
+        """True while the lamp is probably still transitioning to a new setting"""
+        if self.animating:
+            return True
+        return asyncio.get_running_loop().time() < self._settle_deadline
+
+    @property
+    def state(self) -> LampState:
+        """Snapshot of the last known state of the lamp"""
+        return LampState(
+            self._is_on, self._mode, self._brightness, self._rgb, self._temperature
+        )
+
+    @property
+    def state_age(self) -> float:
+        """Seconds since the lamp last notified its state (inf if never)"""
+        if self._state_time is None:
+            return math.inf
+        return time.monotonic() - self._state_time
+
+    def _expect(self, res_type: int) -> asyncio.Future[Any]:
+        """Return the future resolved by the next notification of the given type"""
+        if res_type not in self._pending_responses:
+            loop = asyncio.get_running_loop()
+            self._pending_responses[res_type] = loop.create_future()
+        return self._pending_responses[res_type]
+
+    def _resolve(self, res_type: int, value: Any) -> None:
+        """Hand the decoded answer to everyone waiting for this response type"""
+        future = self._pending_responses.pop(res_type, None)
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    @staticmethod
+    async def _wait_answer(answer: asyncio.Future[Any], timeout: float) -> bool:
+        """Wait for an expected answer. Returns False on timeout"""
+        try:
+            await asyncio.wait_for(asyncio.shield(answer), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _query(
+        self, bits: bytes, res_type: int, priority: Priority = Priority.USER
+    ) -> Any:
+        """Send a query and return the decoded answer, or None if none came.
+        Concurrent queries for the same response type share a single frame,
+        which is then written with the highest priority of its callers.
+        """
+        answer = self._pending_responses.get(res_type)
+        connecting = self._connect_task is asyncio.current_task()
+        # while connecting, queued queries cannot be answered yet:
+        if answer is None or connecting:
+            if priority == Priority.USER and not connecting:
+                self._check_reachable()
+            answer = self._expect(res_type)
             try:
-                await self._client.write_gatt_char(CONTROL_UUID, bytearray(bits))
-                await asyncio.sleep(wait_notif)
-                return True
-            except asyncio.TimeoutError:
-                _LOGGER.error("Send Cmd: Timeout error")
-            except BleakError as err:
-                _LOGGER.error(f"Send Cmd: BleakError: {err}")
-        return False
-
-    async def get_state(self) -> None:
-        """Request the state of the lamp (send back state through notif)"""
-        bits = struct.pack("BBB15x", COMMAND_STX, CMD_GETSTATE, CMD_GETSTATE_SEC)
+                await self.send_cmd(bits, response=res_type, priority=priority)
+            except BaseException:
+                # do not leave an answer nobody will resolve:
+                if self._pending_responses.get(res_type) is answer:
+                    self._resolve(res_type, None)
+                raise
+        else:
+            for pending in self._cmd_queue:
+                if pending.response == res_type and pending.priority > priority:
+                    pending.priority = priority
+                    self._queue_changed.set()
+        if await self._wait_answer(answer, RESPONSE_TIMEOUT):
+            return answer.result()
+        return None
+
+    async def send_cmd(
+        self,
+        bits: bytes | memoryview,
+        response: int | None = None,
+        coalesce: bool = False,
+        priority: Priority = Priority.USER,
+    ) -> bool:
+        """Queue a frame for the lamp and wait for it to be written.
+        If the lamp answers the frame, response is the expected notification type
+        and the queue waits for it (or its timeout) before writing the next frame.
+        With coalesce, a queued frame of the same command class that has not been
+        written yet is dropped in favour of this one (latest-wins).
+        Frames are written by priority, then in order. A user frame drops the
+        lower priority frames still queued, which would be outdated by it.
+        Returns True if this frame was written to the lamp.
+        A user frame raises LampUnreachableError at once, instead of waiting,
+        if the lamp is out of range or its circuit breaker is open.
+        """
+        future: asyncio.Future[bool] = asyncio.get_running_loop().create_future()
+        key = bits[1] if coalesce else None
+        cmd = _PendingCmd(bits, response, key, future, priority)
+        if self._connect_task is asyncio.current_task():
+            # the lamp is being connected: handshake frames skip the queue
+            return await self._send_now(cmd)
+        if priority == Priority.USER:
+            self._check_reachable()
+            self.stop_animation()
+        self._enqueue_cmd(cmd)
+        self._connection_manager.touch(self)
+        try:
+            async with self._send_lock:
+                await self._flush_cmd_queue(cmd)
+        except asyncio.CancelledError:
+            # do not leave a frame nobody waits for in the queue (a frame
+            # already taken by the lock holder is resolved by its writer):
+            if not future.done() and cmd in self._cmd_queue:
+                self._cmd_queue.remove(cmd)
+                future.set_result(False)
+                if response is not None:
+                    self._resolve(response, None)
+            raise
+        self._check_idle()
+        return future.result()
+
+    def _check_idle(self) -> None:
+        if self.idle:
+            self._connection_manager.notify_idle(self)
+            self._schedule_policy(self._policy_delay())
+
+    def _enqueue_cmd(self, cmd: _PendingCmd) -> None:
+        """Append a frame to the queue, dropping the frame it supersedes.
+        Coalescing never crosses a non-coalesced frame (e.g. power) so that
+        the order between power commands and settings is kept.
+        """
+        self._cmd_stats["queued"] += 1
+        self._queue_changed.set()
+        if cmd.priority == Priority.USER:
+            self._drop_background_cmds(cmd)
+        if cmd.key is not None:
+            for pending in reversed(self._cmd_queue):
+                if pending.key is None:
+                    break
+                if pending.key == cmd.key:
+                    self._cmd_queue.remove(pending)
+                    pending.future.set_result(False)
+                    self._cmd_stats["coalesced"] += 1
+                    break
+        self._cmd_queue.append(cmd)
+
+    def _drop_background_cmds(self, cmd: _PendingCmd) -> None:
+        """Drop the queued reads of lower priority than a new user frame"""
+        for pending in [c for c in self._cmd_queue if c.priority > cmd.priority]:
+            self._cmd_queue.remove(pending)
+            pending.future.set_result(False)
+            self._cmd_stats["dropped"] += 1
+            # a read answered by the new frame (e.g. power) shares its answer:
+            if pending.response is not None and pending.response != cmd.response:
+                self._resolve(pending.response, None)
+
+    def _next_cmd(self) -> _PendingCmd | None:
+        """Return the oldest queued frame of the highest priority"""
+        best: _PendingCmd | None = None
+        for cmd in self._cmd_queue:
+            if best is None or cmd.priority < best.priority:
+                best = cmd
+                if cmd.priority == Priority.USER:
+                    break
+        return best
+
+    def _deferred(self, cmd: _PendingCmd) -> float:
+        """Time to hold a background frame back so it does not stop a transition"""
+        if cmd.priority == Priority.USER:
+            return 0
+        if self.animating:
+            # until the next frame (which drops it) or the end of the animation:
+            return TRANSITION_SETTLE
+        return self._settle_deadline - asyncio.get_running_loop().time()
+
+    async def _flush_cmd_queue(self, until: _PendingCmd) -> None:
+        """Write the queued frames by priority, until the given one is written.
+        Must be called with the send lock.
+        """
+        while not until.future.done():
+            cmd = self._next_cmd()
+            if cmd is None:
+                return
+            delay = self._deferred(cmd)
+            if delay > 0:
+                # wait for the lamp to settle, unless a user frame comes first:
+                self._queue_changed.clear()
+                try:
+                    await asyncio.wait_for(self._queue_changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.connect()
+            if self._conn != Conn.PAIRED or self._client is None:
+                self._fail_cmd_queue()
+                return
+            # the queue may have changed while connecting:
+            cmd = self._next_cmd()
+            if cmd is None or self._deferred(cmd) > 0:
+                continue
+            self._cmd_queue.remove(cmd)
+            await self._send_now(cmd)
+
+    async def _send_now(self, cmd: _PendingCmd) -> bool:
+        """Write a frame straight away and resolve its future"""
+        written = False
+        try:
+            if self._client is not None:
+                written = await self._write_cmd(self._client, cmd)
+        finally:
+            self._cmd_stats["written" if written else "failed"] += 1
+            cmd.future.set_result(written)
+            if not written and cmd.response is not None:
+                self._resolve(cmd.response, None)
+        return written
+
+    async def _write_cmd(self, client: BleakClient, cmd: _PendingCmd) -> bool:
+        """Write a frame and wait for its answer, or for the fallback delay"""
+        answer = self._expect(cmd.response) if cmd.response is not None else None
+        start = asyncio.get_running_loop().time()
+        self.trace.record(DIRECTION_OUT, cmd.bits)
+        try:
+            await client.write_gatt_char(CONTROL_UUID, cmd.bits)
+        except asyncio.TimeoutError:
+            _LOGGER.error("Send Cmd: Timeout error")
+            return False
+        except BleakError as err:
+            _LOGGER.error(f"Send Cmd: BleakError: {err}")
+            return False
+        self.metrics.write_latency.observe(asyncio.get_running_loop().time() - start)
+        # frames queued during this wait get coalesced:
+        if answer is None:
+            await asyncio.sleep(self._ack_latency)
+        elif await self._wait_answer(answer, RESPONSE_TIMEOUT):
+            latency = asyncio.get_running_loop().time() - start
+            self._ack_latency = 0.8 * self._ack_latency + 0.2 * latency
+            self.metrics.response_latency.observe(latency)
+        else:
+            _LOGGER.debug(f"Send Cmd: no answer to 0x{cmd.bits.hex()}")
+            self._resolve(cast(int, cmd.response), None)
+        return True
+
+    def _fail_cmd_queue(self) -> None:
+        """Resolve all queued frames as not written"""
+        while self._cmd_queue:
+            self._cmd_stats["failed"] += 1
+            cmd = self._cmd_queue.popleft()
+            cmd.future.set_result(False)
+            if cmd.response is not None:
+                self._resolve(cmd.response, None)
+
+    async def get_state(self, priority: Priority = Priority.USER) -> LampState | None:
+        """Request the state of the lamp (send back state through notif)
+        Background reads (priority RECONCILE or POLL) wait for the end of a
+        transition and are dropped if a user command is sent meanwhile.
+        Returns the decoded state, or None if the lamp did not answer.
+        """
         _LOGGER.debug("Send Cmd: Get_state")
-        await self.send_cmd(bits)
+        state = await self._query(FRAME_GETSTATE, RES_GETSTATE, priority)
+        return cast("LampState | None", state)
 
     async def turn_on(self) -> None:
         """Turn the lamp on. (send back state through notif)"""
-        bits = struct.pack("BBB15x", COMMAND_STX, CMD_POWER, CMD_POWER_ON)
         _LOGGER.debug("Send Cmd: Turn On")
-        await self.send_cmd(bits)
+        await self.send_cmd(FRAME_POWER_ON, response=RES_GETSTATE)
 
     async def turn_off(self) -> None:
         """Turn the lamp off. (send back state through notif)"""
-        bits = struct.pack("BBB15x", COMMAND_STX, CMD_POWER, CMD_POWER_OFF)
         _LOGGER.debug("Send Cmd: Turn Off")
-        await self.send_cmd(bits)
+        await self.send_cmd(FRAME_POWER_OFF, response=RES_GETSTATE)
+
+    def _start_settle(self) -> None:
+        self._settle_deadline = asyncio.get_running_loop().time() + TRANSITION_SETTLE
+
+    def start_transition(
+        self,
+        duration: float,
+        brightness: int | None = None,
+        rgb: tuple[int, int, int] | None = None,
+        temperature: int | None = None,
+        turn_off: bool = False,
+    ) -> asyncio.Task[int]:
+        """Fade to the given settings over duration seconds, in the background.
+        Settings left to None are kept. With turn_off, the lamp fades out and
+        is turned off. Any other command sent to the lamp stops the transition.
+        Returns the task streaming the transition.
+        """
+        target = TransitionTarget(brightness, rgb, temperature, turn_off)
+        _LOGGER.debug(f"Start transition to {target} in {duration}s")
+        return self.animate(run_transition(self, target, duration))
+
+    def animate(
+        self, animation: Coroutine[Any, Any, int], name: str | None = None
+    ) -> asyncio.Task[int]:
+        """Run an animation (transition or named effect) in the background.
+        It replaces the running animation, and stops at the first command sent
+        to the lamp from outside of it.
+        """
+        self.stop_animation()
+        self._animation = asyncio.create_task(animation)
+        self._animation.add_done_callback(self._animation_done)
+        self._animation_name = name
+        return self._animation
+
+    def stop_animation(self) -> None:
+        """Cancel the running animation, unless called from it"""
+        animation = self._animation
+        if animation is not None and animation is not asyncio.current_task():
+            self._animation = None
+            animation.cancel()
+
+    def _animation_done(self, task: asyncio.Task[int]) -> None:
+        if task is self._animation:
+            self._animation = None
+        if not task.cancelled() and task.exception() is not None:
+            _LOGGER.error(f"{self._mac}: animation failed: {task.exception()}")
+        self._check_idle()
 
     # set_brightness/temperature/color do NOT send a notification back.
     # However, the lamp takes time to transition to new state
@@ -328,9 +1149,10 @@ class Lamp:
         """Set the brightness [1-100] (no notif)"""
         brightness = min(100, max(0, int(brightness)))
         _LOGGER.debug(f"Set_brightness {brightness}")
-        bits = struct.pack("BBB15x", COMMAND_STX, CMD_BRIGHTNESS, brightness)
+        bits = encode_brightness(brightness)
         _LOGGER.debug("Send Cmd: Brightness")
-        if await self.send_cmd(bits, wait_notif=0):
+        if await self.send_cmd(bits, coalesce=True):
+            self._start_settle()
             self._brightness = brightness
 
     async def set_temperature(self, kelvin: int, brightness: int | None = None) -> None:
@@ -339,9 +1161,10 @@ class Lamp:
             brightness = self._brightness
         kelvin = min(6500, max(1700, int(kelvin)))
         _LOGGER.debug(f"Set_temperature {kelvin}, {brightness}")
-        bits = struct.pack(">BBhB13x", COMMAND_STX, CMD_TEMP, kelvin, brightness)
+        bits = encode_temperature(kelvin, brightness)
         _LOGGER.debug("Send Cmd: Temperature")
-        if await self.send_cmd(bits, wait_notif=0):
+        if await self.send_cmd(bits, coalesce=True):
+            self._start_settle()
             self._temperature = kelvin
             self._brightness = brightness
             self._mode = self.MODE_WHITE
@@ -353,32 +1176,29 @@ class Lamp:
         if brightness is None:
             brightness = self._brightness
         _LOGGER.debug(f"Set_color {(red, green, blue)}, {brightness}")
-        bits = struct.pack(
-            "BBBBBBB11x", COMMAND_STX, CMD_RGB, red, green, blue, 0x01, brightness
-        )
+        bits = encode_color(red, green, blue, brightness)
         _LOGGER.debug("Send Cmd: Color")
-        if await self.send_cmd(bits, wait_notif=0):
+        if await self.send_cmd(bits, coalesce=True):
+            self._start_settle()
             self._rgb = (red, green, blue)
             self._brightness = brightness
             self._mode = self.MODE_COLOR
 
-    async def get_name(self) -> None:
+    async def get_name(self) -> str | None:
         """Get the name from the lamp (through notif)"""
-        bits = struct.pack("BB16x", COMMAND_STX, CMD_GETNAME)
         _LOGGER.debug("Send Cmd: Get_Name")
-        await self.send_cmd(bits)
+        return cast("str | None", await self._query(FRAME_GETNAME, RES_GETNAME))
 
-    async def get_version(self) -> None:
+    async def get_version(self) -> VersionResult | None:
         """Get the versions from the lamp (through notif)"""
-        bits = struct.pack("BB16x", COMMAND_STX, CMD_GETVER)
         _LOGGER.debug("Send Cmd: Get_Version")
-        await self.send_cmd(bits)
+        version = await self._query(FRAME_GETVER, RES_GETVER)
+        return cast("VersionResult | None", version)
 
-    async def get_serial(self) -> None:
+    async def get_serial(self) -> int | None:
         """Get the serial from the lamp (through notif)"""
-        bits = struct.pack("BB16x", COMMAND_STX, CMD_GETSERIAL)
         _LOGGER.debug("Send Cmd: Get_Serial")
-        await self.send_cmd(bits)
+        return cast("int | None", await self._query(FRAME_GETSERIAL, RES_GETSERIAL))
 
     def notification_handler(self, cHandle: int, data: bytearray) -> None:
         """Method called when a notification is sent from the lamp
@@ -387,65 +1207,89 @@ class Lamp:
         the Lamp object's data
         :args: - data : the received data from the lamp in hex format
         """
-        _LOGGER.debug(f"Received 0x{data.hex()} from handle={cHandle}")
-
-        res_type = struct.unpack("xB16x", data)[0]  # the type of response we got
-        if res_type == RES_GETSTATE:  # state result
-            state = struct.unpack(">xxBBBBBBBhx6x", data)
-            self._is_on = state[0] == CMD_POWER_ON
-            if self._model == MODEL_CANDELA:
-                self._brightness = state[1]
-                self._mode = (
-                    state[2] if self._conn == Conn.PAIRED else None
-                )  # Not entirely sure this is the mode...
-                # Candela seems to also give something in state 3 and 4...
-            else:
-                self._mode = state[1] if self._conn == Conn.PAIRED else None
-                self._rgb = (state[2], state[3], state[4])  # , state[5])
-                self._brightness = state[6]
-                self._temperature = state[7]
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(f"Received 0x{data.hex()} from handle={cHandle}")
+        self.metrics.notifications += 1
+        self.trace.record(DIRECTION_IN, data)
+        decoded = decode_notification(data, self._decoders)
+        if decoded is None:
+            return
+        res_type, result = decoded
+        answer = None  # passed to whoever awaits this response type
+        if result is not None:
+            handler = self._handlers.get(res_type)
+            answer = result if handler is None else handler(result)
+        # release anyone waiting for this response:
+        self._resolve(res_type, answer)
+
+    def _on_state(self, result: StateResult) -> LampState:
+        self._mode = result.mode if self._conn == Conn.PAIRED else None
+        self._rgb = (result.red, result.green, result.blue)
+        self._brightness = result.brightness
+        self._temperature = result.temperature
+        return self._state_notified(result.power)
+
+    def _on_candela_state(self, result: CandelaStateResult) -> LampState:
+        self._brightness = result.brightness
+        # Not entirely sure this is the mode...
+        self._mode = result.mode if self._conn == Conn.PAIRED else None
+        return self._state_notified(result.power)
+
+    def _state_notified(self, power: int) -> LampState:
+        self._state_time = time.monotonic()
+        self._is_on = power == CMD_POWER_ON
+        if _LOGGER.isEnabledFor(logging.DEBUG):
             _LOGGER.debug(self)
-            # Call any callback registered:
-            self.run_state_changed_cb()
-
-        if res_type == RES_PAIR:  # pairing result
-            pair_mode = struct.unpack("xxB15x", data)[0]
-            if pair_mode == 0x01:  # The lamp is requesting pairing. push small button!
-                _LOGGER.error(
-                    "Yeelight pairing request: Push the little button of the lamp now! (All commands will be ignored until the lamp is paired)"
-                )
-                self._mode = None  # unavailable in HA for now
-                self._conn = Conn.PAIRING
-            if pair_mode == 0x02:
-                _LOGGER.debug("Yeelight pairing was successful!")
-                self._conn = Conn.PAIRED
-                self._pair_resp_event.set()
-            if pair_mode == 0x03:
-                _LOGGER.error(
-                    "Yeelight is not paired! The next connection will attempt a new pairing request."
-                )
-                self._mode = None  # unavailable in HA
-                self._conn = Conn.UNPAIRED
-                self._pair_resp_event.set()
-            if pair_mode == 0x04:
-                _LOGGER.debug("Yeelight is already paired")
-                self._conn = Conn.PAIRED
-                self._pair_resp_event.set()
-            if pair_mode == 0x06 or pair_mode == 0x07:
-                # 0x07: Lamp disconnect imminent
-                _LOGGER.error(
-                    "The pairing request returned unexpected results. Please reset the lamp (https://www.youtube.com/watch?v=PnjcOSgnbAM) and the pairing process will be attempted again on next connection."
-                )
-                self._conn = Conn.UNPAIRED
-                self._pair_resp_event.set()
-
-        if res_type == RES_GETVER:
-            self.versions = cast(str, struct.unpack("xxBHHHH6x", data))
-            _LOGGER.info(f"Lamp {self._mac} exposes versions:{self.versions}")
+        self._last_state = self.state
+        # Call any callback registered:
+        self.run_state_changed_cb()
+        return self._last_state
 
-        if res_type == RES_GETSERIAL:
-            self.serial = struct.unpack("xxB15x", data)[0]
-            _LOGGER.info(f"Lamp {self._mac} exposes serial:{self.serial}")
+    def _on_pair(self, result: PairResult) -> int:
+        pair_mode = result.status
+        if pair_mode == 0x01:  # The lamp is requesting pairing. push small button!
+            _LOGGER.error(
+                "Yeelight pairing request: Push the little button of the lamp now! (All commands will be ignored until the lamp is paired)"
+            )
+            self._mode = None  # unavailable in HA for now
+            self._conn = Conn.PAIRING
+        elif pair_mode == 0x02:
+            _LOGGER.debug("Yeelight pairing was successful!")
+            self._conn = Conn.PAIRED
+            self.paired = True
+        elif pair_mode == 0x03:
+            _LOGGER.error(
+                "Yeelight is not paired! The next connection will attempt a new pairing request."
+            )
+            self._mode = None  # unavailable in HA
+            self._conn = Conn.UNPAIRED
+            self.paired = False
+        elif pair_mode == 0x04:
+            _LOGGER.debug("Yeelight is already paired")
+            self._conn = Conn.PAIRED
+            self.paired = True
+        elif pair_mode == 0x06 or pair_mode == 0x07:
+            # 0x07: Lamp disconnect imminent
+            _LOGGER.error(
+                "The pairing request returned unexpected results. Please reset the lamp (https://www.youtube.com/watch?v=PnjcOSgnbAM) and the pairing process will be attempted again on next connection."
+            )
+            self._conn = Conn.UNPAIRED
+        return pair_mode
+
+    def _on_version(self, result: VersionResult) -> VersionResult:
+        self.versions = result
+        _LOGGER.info(f"Lamp {self._mac} exposes versions:{self.versions}")
+        return result
+
+    def _on_serial(self, result: SerialResult) -> int:
+        self.serial = result.serial
+        _LOGGER.info(f"Lamp {self._mac} exposes serial:{self.serial}")
+        return result.serial
+
+    def _on_name(self, result: NameResult) -> str:
+        self.name = result.name
+        _LOGGER.info(f"Lamp {self._mac} exposes name:{self.name}")
+        return result.name
 
     async def read_services(self) -> None:
         if self._client is None:
@@ -0,0 +1,26 @@
+"""Tests of the benchmark of the command path, against simulated lamps"""
+from __future__ import annotations
+
+import json
+import sys
+
+import pytest
+
+from custom_components.yeelight_bt import benchmark
+
+
+def test_main_runs_on_the_simulator(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    monkeypatch.setattr(
+        sys, "argv", ["benchmark", "--lamps", "1", "3", "--commands", "12"]
+    )
+    # exits with an error if concurrent callers do not share one connection:
+    benchmark.main()
+    results = json.loads(capsys.readouterr().out)
+    assert [run["lamps"] for run in results["runs"]] == [1, 3]
+    assert results["single_flight"]["connections"] == 1
+    assert results["single_flight"]["errors"] == 0
+    for run in results["runs"]:
+        # including the commands sent through the light entity:
+        assert run["commands"]["entity_turn_on"]["count"] == 2 * run["lamps"]
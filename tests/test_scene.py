@@ -0,0 +1,27 @@
+"""Tests of the frames planned to bring a lamp to a scene"""
+from __future__ import annotations
+
+from custom_components.yeelight_bt.scene import Scene, plan
+from custom_components.yeelight_bt.yeelightbt import Lamp, LampState
+
+STATE = LampState(True, Lamp.MODE_COLOR, 50, (255, 0, 0), 4000)
+
+
+def test_explicit_settings_are_always_sent() -> None:
+    # the state may be outdated, only the power on is skipped:
+    frames = plan(STATE, Scene(brightness=50, rgb=(255, 0, 0)))
+    assert [frame.command for frame in frames] == ["color"]
+    frames = plan(STATE, Scene(brightness=51))
+    assert [frame.command for frame in frames] == ["brightness"]
+
+
+def test_restore_skips_imperceptible_changes() -> None:
+    assert plan(STATE, Scene(brightness=51, rgb=(254, 1, 0)), restore=True) == []
+    frames = plan(STATE, Scene(brightness=60, rgb=(254, 1, 0)), restore=True)
+    assert [frame.command for frame in frames] == ["brightness"]
+    # relative to the brightness, small steps of a dim lamp are visible:
+    dim = STATE._replace(brightness=1)
+    frames = plan(dim, Scene(brightness=2), restore=True)
+    assert [frame.command for frame in frames] == ["brightness"]
+    frames = plan(STATE._replace(is_on=False), Scene(brightness=50), restore=True)
+    assert [frame.command for frame in frames] == ["turn_on"]
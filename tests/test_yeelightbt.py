@@ -0,0 +1,41 @@
+"""Tests of the lamp command queue, against simulated lamps"""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from custom_components.yeelight_bt.codec import encode_brightness
+from custom_components.yeelight_bt.simulator import Simulator
+from custom_components.yeelight_bt.yeelightbt import Lamp, Priority
+
+
+def test_cancel_frame_written_by_another_task() -> None:
+    """A caller cancelled while the send lock holder writes its frame gets the
+    cancellation, and the holder carries on.
+    """
+
+    async def run() -> None:
+        simulator = Simulator(seed=1)
+        device = simulator.add_lamp(latency=0.05, connect_latency=0.05)
+        lamp = Lamp(device.ble_device, connector=simulator.establish_connection)
+        # the poll takes the send lock, and connects the lamp:
+        poll = asyncio.create_task(lamp.get_state(Priority.POLL))
+        await asyncio.sleep(0.01)
+        reconcile = asyncio.create_task(
+            lamp.send_cmd(encode_brightness(40), priority=Priority.RECONCILE)
+        )
+        await asyncio.sleep(0)
+        cmd = lamp._cmd_queue[-1]
+        # written first by the poll once connected, for being more urgent:
+        while cmd in lamp._cmd_queue:
+            await asyncio.sleep(0.001)
+        assert not cmd.future.done()
+        reconcile.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await reconcile
+        assert await poll is not None
+        assert not lamp._cmd_queue
+        await lamp.close()
+
+    asyncio.run(run())